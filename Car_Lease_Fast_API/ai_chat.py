@@ -1,14 +1,20 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
+import json
+import time
 
 from database import SessionLocal
 from models import LeaseAnalysis
-from llm_utils import chat_with_llm
+from llm_utils import chat_with_llm, stream_chat_with_llm
 from auth import get_current_user
+from lease_digest import get_lease_digest
 
 router = APIRouter()
 
+CHAT_ERROR_REPLY = "⚠️ I had trouble answering that. Please try again."
+
 
 # REQUEST SCHEMA
 class ChatRequest(BaseModel):
@@ -23,13 +29,8 @@ def get_db():
     finally:
         db.close()
 
-# CHAT ENDPOINT
-@router.post("/")
-def lease_aware_chat(
-    chat: ChatRequest,
-    db: Session = Depends(get_db),
-    user=Depends(get_current_user),
-):
+
+def _load_record(db: Session, chat: ChatRequest, user) -> LeaseAnalysis:
     # Fetch lease securely
     record = (
         db.query(LeaseAnalysis)
@@ -43,19 +44,19 @@ def lease_aware_chat(
     if not record:
         raise HTTPException(status_code=404, detail="Lease record not found")
 
-    user_msg = chat.message.lower().strip()
+    return record
+
+
+def _fast_reply(record: LeaseAnalysis, user_msg: str) -> str | None:
+    """Canned answers that need no AI call, or None."""
     fairness = record.fairness_analysis or {}
 
     # FAST RESPONSES (NO AI CALL)
     if user_msg in {"hi", "hello", "hey"}:
-        return {
-            "reply": "Hi! 👋 I can help you understand your car lease — risks, costs, fairness, or buying options."
-        }
+        return "Hi! 👋 I can help you understand your car lease — risks, costs, fairness, or buying options."
 
     if user_msg in {"thanks", "thank you"}:
-        return {
-            "reply": "You’re welcome! 😊 Feel free to ask if you need help with any part of the lease."
-        }
+        return "You’re welcome! 😊 Feel free to ask if you need help with any part of the lease."
 
     # LEASE FAIRNESS
     if "fairness" in user_msg or "contract" in user_msg:
@@ -64,22 +65,18 @@ def lease_aware_chat(
         fairness = {}
 
         if not fairness:
-            return {
-                "reply": (
-                    "📄 **Lease Fairness**\n\n"
-                    "I couldn’t calculate a lease fairness score because some contract details are missing.\n\n"
-                    "This usually happens when monthly payments, penalties, or end-of-lease terms are unclear."
-                )
-            }
-
-        return {
-            "reply": (
-                "📄 **Lease Fairness Explained**\n\n"
-                f"• Score: {fairness.get('score', 'N/A')}\n"
-                f"• Summary: {fairness.get('summary', 'No summary available')}\n"
-                f"• Recommendation: {fairness.get('recommendation', 'Review carefully')}"
+            return (
+                "📄 **Lease Fairness**\n\n"
+                "I couldn’t calculate a lease fairness score because some contract details are missing.\n\n"
+                "This usually happens when monthly payments, penalties, or end-of-lease terms are unclear."
             )
-        }
+
+        return (
+            "📄 **Lease Fairness Explained**\n\n"
+            f"• Score: {fairness.get('score', 'N/A')}\n"
+            f"• Summary: {fairness.get('summary', 'No summary available')}\n"
+            f"• Recommendation: {fairness.get('recommendation', 'Review carefully')}"
+        )
 
 
     # CAR HISTORY / DAMAGE
@@ -87,31 +84,27 @@ def lease_aware_chat(
         history = record.car_full_history or {}
 
         if history is None:
-            return {
-                "reply": (
-                    "🚗 **Car History**\n\n"
-                    "Car history data is not available yet.\n"
-                    "This may take a few seconds after analysis or the VIN may be missing."
-                )
-            }
-
-        return {
-            "reply": (
-                "🚗 **Car History Summary**\n\n"
-                "• Accident history: "
-                f"{history.get('accidents', 'Not reported')}\n"
-                "• Damage reports: "
-                f"{history.get('damage', 'Not reported')}\n"
-                "• Ownership records: "
-                f"{history.get('owners', 'Not available')}\n\n"
-                "If you want, I can explain whether this history increases risk."
+            return (
+                "🚗 **Car History**\n\n"
+                "Car history data is not available yet.\n"
+                "This may take a few seconds after analysis or the VIN may be missing."
             )
-        }
 
+        return (
+            "🚗 **Car History Summary**\n\n"
+            "• Accident history: "
+            f"{history.get('accidents', 'Not reported')}\n"
+            "• Damage reports: "
+            f"{history.get('damage', 'Not reported')}\n"
+            "• Ownership records: "
+            f"{history.get('owners', 'Not available')}\n\n"
+            "If you want, I can explain whether this history increases risk."
+        )
+
+    return None
 
-    # AI SYSTEM PROMPT
-    system_prompt = f"""
-You are a friendly, professional AI assistant inside a Car Lease Analysis app.
+
+CHAT_SYSTEM_PROMPT = """You are a friendly, professional AI assistant inside a Car Lease Analysis app.
 
 Your job:
 - Help users understand their uploaded car lease
@@ -129,25 +122,89 @@ Tone:
 - Friendly
 - Clear
 - Simple English
-- Not robotic
+- Not robotic"""
+
 
-Lease analysis:
-{record.analysis_result}
+def _system_prompt(record: LeaseAnalysis) -> str:
+    # AI SYSTEM PROMPT (lease digest is built once per record)
+    return f"{CHAT_SYSTEM_PROMPT}\n\nThe user's lease:\n{get_lease_digest(record)}"
 
-Fairness analysis:
-{fairness}
 
-Car history:
-{record.car_full_history or "No car history available"}
-"""
+# CHAT ENDPOINT
+@router.post("/")
+def lease_aware_chat(
+    chat: ChatRequest,
+    db: Session = Depends(get_db),
+    user=Depends(get_current_user),
+):
+    record = _load_record(db, chat, user)
+
+    fast_reply = _fast_reply(record, chat.message.lower().strip())
+    if fast_reply is not None:
+        return {"reply": fast_reply}
 
     # AI RESPONSE
     try:
         reply = chat_with_llm(
-            system_prompt=system_prompt,
+            system_prompt=_system_prompt(record),
             user_message=chat.message,
+            user_key=user.id,
         )
     except Exception:
-        reply = "⚠️ I had trouble answering that. Please try again."
+        reply = CHAT_ERROR_REPLY
 
     return {"reply": reply}
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+# STREAMING CHAT ENDPOINT (SSE)
+# Events: token {text}, done {reply, ttft_ms, fast_path}
+@router.post("/stream")
+def lease_aware_chat_stream(
+    chat: ChatRequest,
+    db: Session = Depends(get_db),
+    user=Depends(get_current_user),
+):
+    started = time.perf_counter()
+    record = _load_record(db, chat, user)
+
+    fast_reply = _fast_reply(record, chat.message.lower().strip())
+    # Built now, the DB session is gone once streaming starts
+    system_prompt = _system_prompt(record) if fast_reply is None else None
+    user_id = user.id
+
+    def events():
+        if fast_reply is not None:
+            ttft_ms = round((time.perf_counter() - started) * 1000)
+            print(f"CHAT TTFT: {ttft_ms} ms (fast path)")
+            yield _sse("token", {"text": fast_reply})
+            yield _sse("done", {"reply": fast_reply, "ttft_ms": ttft_ms, "fast_path": True})
+            return
+
+        parts = []
+        ttft_ms = None
+        try:
+            for token in stream_chat_with_llm(system_prompt, chat.message, user_key=user_id):
+                if ttft_ms is None:
+                    ttft_ms = round((time.perf_counter() - started) * 1000)
+                    print(f"CHAT TTFT: {ttft_ms} ms")
+                parts.append(token)
+                yield _sse("token", {"text": token})
+        except Exception as e:
+            print("Chat stream error:", e)
+            if not parts:
+                parts.append(CHAT_ERROR_REPLY)
+                yield _sse("token", {"text": CHAT_ERROR_REPLY})
+
+        total_ms = round((time.perf_counter() - started) * 1000)
+        print(f"CHAT STREAM DONE: {total_ms} ms")
+        yield _sse("done", {"reply": "".join(parts), "ttft_ms": ttft_ms, "fast_path": False})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
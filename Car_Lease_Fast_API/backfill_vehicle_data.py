@@ -0,0 +1,81 @@
+"""
+Backfill vehicle_api_data for stored leases that have a VIN but no decode.
+
+Usage:
+    python backfill_vehicle_data.py [--chunk-size 500] [--limit N] [--retry-errors] [--dry-run]
+
+VINs are decoded in NHTSA batch requests (see VinLookupService.lookup_many)
+and each chunk of rows is written back in one commit.
+"""
+import argparse
+
+from database import SessionLocal
+from models import LeaseAnalysis
+from vin_utils import decode_vins
+
+
+def _needs_backfill(vehicle_api_data, retry_errors: bool) -> bool:
+    if not vehicle_api_data:
+        return True
+    return retry_errors and "error" in vehicle_api_data
+
+
+def _pending_rows(db, retry_errors: bool, limit: int | None) -> list[tuple[int, str]]:
+    rows = []
+    query = (
+        db.query(LeaseAnalysis.id, LeaseAnalysis.vin, LeaseAnalysis.vehicle_api_data)
+        .filter(LeaseAnalysis.vin.isnot(None))
+        .order_by(LeaseAnalysis.id)
+        .yield_per(1000)
+    )
+    for record_id, vin, vehicle_api_data in query:
+        if _needs_backfill(vehicle_api_data, retry_errors):
+            rows.append((record_id, vin))
+            if limit and len(rows) >= limit:
+                break
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill vehicle_api_data from batched VIN decodes")
+    parser.add_argument("--chunk-size", type=int, default=500, help="rows decoded and committed together")
+    parser.add_argument("--limit", type=int, default=None, help="stop after this many rows")
+    parser.add_argument("--retry-errors", action="store_true", help="also redo rows whose last decode failed")
+    parser.add_argument("--dry-run", action="store_true", help="decode but do not write")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        rows = _pending_rows(db, args.retry_errors, args.limit)
+        print(f"{len(rows)} lease(s) need vehicle data")
+
+        updated = 0
+        failed = 0
+        for start in range(0, len(rows), args.chunk_size):
+            chunk = rows[start:start + args.chunk_size]
+            decoded = decode_vins([vin for _, vin in chunk])
+
+            mappings = [
+                {"id": record_id, "vehicle_api_data": decoded[vin]}
+                for record_id, vin in chunk
+                if vin in decoded
+            ]
+
+            if not args.dry_run:
+                db.bulk_update_mappings(LeaseAnalysis, mappings)
+                db.commit()
+
+            updated += len(mappings)
+            failed += sum(1 for mapping in mappings if "error" in mapping["vehicle_api_data"])
+            print(f"  {start + len(chunk)}/{len(rows)} processed, {updated} updated")
+
+        print(f"Done: {updated} lease(s) {'would be ' if args.dry_run else ''}updated")
+        if failed:
+            # Stored with offline data and an "error" key
+            print(f"{failed} lease(s) got no NHTSA data, rerun with --retry-errors")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
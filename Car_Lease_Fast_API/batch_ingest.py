@@ -0,0 +1,59 @@
+"""
+Command-line batch ingestion for fleet lease portfolios.
+
+Usage:
+    python batch_ingest.py --email fleet@example.com leases/ more.zip one.pdf
+
+Directories are scanned recursively. The per-file manifest is printed as JSON.
+"""
+import argparse
+import json
+import os
+
+from database import SessionLocal
+from models import User
+from routes.batch_upload import store_batch_file
+from upload_pipeline import UPLOAD_DIR, create_batch_jobs, ingest_batch
+
+
+def _iter_files(paths: list[str]):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                for name in sorted(names):
+                    yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze many lease files at once")
+    parser.add_argument("--email", required=True, help="account the leases are stored under")
+    parser.add_argument("paths", nargs="+", help="lease files, zip archives or directories")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.email == args.email).first()
+        if user is None:
+            raise SystemExit(f"No user with email {args.email}")
+        user_id = user.id
+    finally:
+        db.close()
+
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+    uploads = []
+    for path in _iter_files(args.paths):
+        with open(path, "rb") as f:
+            uploads.extend(store_batch_file(user_id, os.path.basename(path), f))
+
+    print(f"Ingesting {len(uploads)} lease file(s)")
+    batch_id, job_ids = create_batch_jobs(user_id, uploads)
+    print(f"Batch {batch_id}")
+    manifest = ingest_batch(job_ids)
+    print(json.dumps(manifest, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Micro-benchmark: PIL preprocessing chain vs the NumPy array pipeline.
+
+Usage:
+    python bench_preprocess.py ../contracts/FORD.pdf
+    python bench_preprocess.py            # synthetic 300 DPI page
+
+Each variant runs in a fresh process so peak memory (max RSS growth
+while preprocessing) is not polluted by the other variant.
+"""
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageDraw
+
+from ocr_utils import OCR_DPI, iter_pdf_pages, preprocess_array, preprocess_image
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+VARIANTS = {
+    "pil": preprocess_image,
+    "numpy": preprocess_array,
+    "numpy-otsu": lambda img: preprocess_array(img, threshold_mode="otsu"),
+    "numpy-adaptive": lambda img: preprocess_array(img, threshold_mode="adaptive"),
+}
+
+REPEATS = 3
+
+
+def _load_pages(pdf_path: str | None) -> list[Image.Image]:
+    if pdf_path:
+        return list(iter_pdf_pages(pdf_path, dpi=OCR_DPI))
+
+    # Letter page at 300 DPI with lines of text
+    page = Image.new("RGB", (2550, 3300), "white")
+    draw = ImageDraw.Draw(page)
+    for y in range(150, 3150, 45):
+        draw.text((150, y), "LEASE AGREEMENT  Monthly Payment INR 24,500  VIN 1HGCM82633A004352", fill="black")
+    return [page]
+
+
+def _max_rss_kb() -> int:
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _run_variant(name: str, pdf_path: str | None) -> tuple[float, int, int]:
+    pages = _load_pages(pdf_path)
+    fn = VARIANTS[name]
+
+    baseline = _max_rss_kb()
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        for page in pages:
+            fn(page)
+    elapsed = time.perf_counter() - start
+
+    per_page_ms = elapsed * 1000 / (REPEATS * len(pages))
+    return per_page_ms, _max_rss_kb() - baseline, len(pages)
+
+
+def main():
+    pdf_path = sys.argv[1] if len(sys.argv) > 1 else None
+
+    print(f"{'variant':<16}{'ms/page':>10}{'peak MB':>10}")
+    for name in VARIANTS:
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            per_page_ms, peak_kb, page_count = pool.submit(_run_variant, name, pdf_path).result()
+
+        peak = f"{peak_kb / 1024:.1f}" if resource is not None else "n/a"
+        print(f"{name:<16}{per_page_ms:>10.1f}{peak:>10}")
+
+    print(f"({page_count} page(s), {REPEATS} repeats)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,4 @@
-import os
-from groq import Groq
-
-client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+import groq_client
 
 def call_dealer_ai(
     user_message,
@@ -10,6 +7,8 @@ def call_dealer_ai(
     vin=None,
     make=None,
     model=None,
+    user_key=None,
+    digest=None,
 ):
 
     # -------------------------------
@@ -41,6 +40,17 @@ def call_dealer_ai(
             + "\n".join(vehicle_context_lines)
         )
 
+    # -------------------------------
+    # LEASE CONTEXT (stored digest when available)
+    # -------------------------------
+    if digest:
+        lease_context = f"Lease summary:\n{digest}"
+    else:
+        lease_context = (
+            f"Lease fairness score: {fairness.get('fairness_score')}\n"
+            f"Red flags: {fairness.get('red_flags')}"
+        )
+
     # -------------------------------
     # SYSTEM PROMPT
     # -------------------------------
@@ -58,24 +68,22 @@ IMPORTANT RULES:
 - Avoid repeating the same sentence
 - Keep replies concise (2–4 lines)
 
-Lease fairness score: {fairness.get("fairness_score")}
-Red flags: {fairness.get("red_flags")}
+{lease_context}
 """
 
     # -------------------------------
     # GROQ CALL
     # -------------------------------
     try:
-        response = client.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            messages=[
+        content = groq_client.complete(
+            [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_message},
             ],
             temperature=0.7,
+            user_key=user_key,
         )
 
-        content = response.choices[0].message.content
         if content is not None:
             return content.strip()
 
@@ -95,6 +103,8 @@ def call_customer_negotiation_ai(
     vin=None,
     make=None,
     model=None,
+    user_key=None,
+    digest=None,
 ):
     """
     Customer-side hidden AI assistant.
@@ -106,11 +116,17 @@ def call_customer_negotiation_ai(
     model_val = str(model) if model is not None else ""
     vin_val = str(vin) if vin is not None else "Unknown"
 
-    monthly_payment = analysis.get("monthly_payment", "Unknown")
-    residual_value = analysis.get("residual_value", "Unknown")
-    money_factor = analysis.get("money_factor", "Unknown")
-    fairness_score = fairness.get("fairness_score", "Unknown")
-    red_flags = fairness.get("red_flags", [])
+    if digest:
+        lease_context = f"Lease summary:\n{digest}"
+    else:
+        lease_context = (
+            "Lease Details:\n"
+            f"Monthly Payment: {analysis.get('monthly_payment', 'Unknown')}\n"
+            f"Residual Value: {analysis.get('residual_value', 'Unknown')}\n"
+            f"Money Factor: {analysis.get('money_factor', 'Unknown')}\n"
+            f"Fairness Score: {fairness.get('fairness_score', 'Unknown')}\n"
+            f"Red Flags: {fairness.get('red_flags', [])}"
+        )
 
     system_prompt = f"""
 You are a professional car lease negotiation expert helping a customer.
@@ -118,12 +134,7 @@ You are a professional car lease negotiation expert helping a customer.
 Vehicle: {make_val} {model_val}
 VIN: {vin_val}
 
-Lease Details:
-Monthly Payment: {monthly_payment}
-Residual Value: {residual_value}
-Money Factor: {money_factor}
-Fairness Score: {fairness_score}
-Red Flags: {red_flags}
+{lease_context}
 
 IMPORTANT:
 - Provide EXACTLY 3 short negotiation suggestions.
@@ -132,15 +143,11 @@ IMPORTANT:
 - Do NOT add explanations.
 - Do NOT number them.
 - Just plain short negotiation sentences.
-
-Lease fairness score: {fairness.get("fairness_score")}
-Red flags: {fairness.get("red_flags")}
 """
 
     try:
-        response = client.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            messages=[
+        content = groq_client.complete(
+            [
                 {"role": "system", "content": system_prompt},
                 {
                     "role": "user",
@@ -148,9 +155,9 @@ Red flags: {fairness.get("red_flags")}
                 },
             ],
             temperature=0.6,
+            user_key=user_key,
         )
 
-        content = response.choices[0].message.content
         if content:
             return content.strip()
 
@@ -0,0 +1,260 @@
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import os
+import queue
+import threading
+from collections import OrderedDict, deque
+
+from groq import AsyncGroq
+
+LLM_MODEL = "llama-3.1-8b-instant"
+
+# Upstream requests allowed at once across the whole process (Groq rate limit)
+GROQ_MAX_IN_FLIGHT = int(os.getenv("GROQ_MAX_IN_FLIGHT", "8"))
+GROQ_TIMEOUT_SECONDS = float(os.getenv("GROQ_TIMEOUT_SECONDS", "60"))
+
+
+class FairLimiter:
+    """
+    Caps concurrent upstream calls. When the cap is reached, waiters are
+    queued per user and freed slots are handed out round-robin, so one
+    user's batch upload cannot starve everyone else's chat.
+    Only used from the client's event loop thread.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self._queues: OrderedDict[str, deque] = OrderedDict()
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def acquire(self, user_key: str) -> None:
+        if self.active < self.limit and not self._queues:
+            self.active += 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(user_key, deque()).append(waiter)
+
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just before cancellation
+                self.release()
+            else:
+                self._discard(user_key, waiter)
+            raise
+
+    def release(self) -> None:
+        while self._queues:
+            user_key = next(iter(self._queues))
+            queue = self._queues[user_key]
+            waiter = queue.popleft()
+
+            # Served users go to the back of the line
+            if queue:
+                self._queues.move_to_end(user_key)
+            else:
+                del self._queues[user_key]
+
+            if not waiter.done():
+                # Slot passes straight to the waiter, active count unchanged
+                waiter.set_result(None)
+                return
+
+        self.active -= 1
+
+    def _discard(self, user_key: str, waiter) -> None:
+        queue = self._queues.get(user_key)
+        if queue is None:
+            return
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            pass
+        if not queue:
+            del self._queues[user_key]
+
+
+# EVENT LOOP THREAD
+# Sync request handlers and worker threads submit coroutines here
+
+_loop = None
+_loop_lock = threading.Lock()
+
+_client = None
+_limiter = None
+_in_flight: dict[str, asyncio.Task] = {}
+_stats = {"requests": 0, "upstream_calls": 0, "coalesced": 0}
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="groq-client", daemon=True)
+            thread.start()
+            _loop = loop
+    return _loop
+
+
+def _request_key(model: str, messages: list[dict], temperature: float) -> str:
+    raw = json.dumps(
+        {"model": model, "messages": messages, "temperature": temperature},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _ensure_client() -> None:
+    global _client, _limiter
+
+    # Created lazily so both are bound to the client loop
+    if _client is None:
+        _client = AsyncGroq(api_key=os.getenv("GROQ_API_KEY"), timeout=GROQ_TIMEOUT_SECONDS)
+    if _limiter is None:
+        _limiter = FairLimiter(GROQ_MAX_IN_FLIGHT)
+
+
+async def _call_upstream(model: str, messages: list[dict], temperature: float, user_key: str):
+    _ensure_client()
+
+    await _limiter.acquire(user_key)
+    try:
+        _stats["upstream_calls"] += 1
+        response = await _client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+        )
+    finally:
+        _limiter.release()
+
+    return response.choices[0].message.content
+
+
+async def acomplete(
+    messages: list[dict],
+    temperature: float = 0.0,
+    model: str = LLM_MODEL,
+    user_key=None,
+):
+    """
+    Chat completion through the shared limiter. Identical requests that
+    are already in flight share the same upstream call.
+    Returns the message content (may be None).
+    """
+    _stats["requests"] += 1
+    key = _request_key(model, messages, temperature)
+
+    task = _in_flight.get(key)
+    if task is not None:
+        _stats["coalesced"] += 1
+    else:
+        task = asyncio.ensure_future(
+            _call_upstream(model, messages, temperature, str(user_key or "anonymous"))
+        )
+        _in_flight[key] = task
+        task.add_done_callback(lambda _: _in_flight.pop(key, None))
+
+    # One caller giving up must not cancel the call for the others
+    return await asyncio.shield(task)
+
+
+def submit(
+    messages: list[dict],
+    temperature: float = 0.0,
+    model: str = LLM_MODEL,
+    user_key=None,
+) -> concurrent.futures.Future:
+    """Schedule a completion from any thread; returns a concurrent future."""
+    return asyncio.run_coroutine_threadsafe(
+        acomplete(messages, temperature=temperature, model=model, user_key=user_key),
+        _get_loop(),
+    )
+
+
+def complete(
+    messages: list[dict],
+    temperature: float = 0.0,
+    model: str = LLM_MODEL,
+    user_key=None,
+):
+    """
+    Blocking wrapper around acomplete for sync handlers and worker threads.
+    Must not be called from the client loop itself.
+    """
+    return submit(messages, temperature=temperature, model=model, user_key=user_key).result()
+
+
+async def _stream_upstream(model: str, messages: list[dict], temperature: float, user_key: str, emit) -> None:
+    _ensure_client()
+
+    await _limiter.acquire(user_key)
+    try:
+        _stats["upstream_calls"] += 1
+        response = await _client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            stream=True,
+        )
+        async for chunk in response:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                emit(delta)
+    finally:
+        _limiter.release()
+
+
+def stream(
+    messages: list[dict],
+    temperature: float = 0.0,
+    model: str = LLM_MODEL,
+    user_key=None,
+):
+    """
+    Blocking generator yielding completion tokens as they arrive.
+    Streams hold a limiter slot for their whole duration and are never
+    coalesced. Closing the generator early cancels the upstream call.
+    """
+    _stats["requests"] += 1
+    tokens = queue.Queue()
+    finished = object()
+
+    async def run():
+        try:
+            await _stream_upstream(model, messages, temperature, str(user_key or "anonymous"), tokens.put)
+        finally:
+            tokens.put(finished)
+
+    future = asyncio.run_coroutine_threadsafe(run(), _get_loop())
+    try:
+        while True:
+            token = tokens.get()
+            if token is finished:
+                break
+            yield token
+        # Surface upstream errors to the caller
+        future.result()
+    finally:
+        future.cancel()
+
+
+def stats() -> dict:
+    return {
+        **_stats,
+        "in_flight": _limiter.active if _limiter else 0,
+        "queued": _limiter.queued if _limiter else 0,
+        "max_in_flight": GROQ_MAX_IN_FLIGHT,
+    }
@@ -0,0 +1,341 @@
+"""
+Shared outbound HTTP layer.
+
+One keep-alive connection pool per process (sync and async), a
+concurrency limit per host, retries with jittered exponential backoff and
+a per-host circuit breaker that counts one outcome per request, not per
+attempt. Base URLs can be redirected to a local stub server with
+HTTP_BASE_URL_OVERRIDES, e.g.
+    HTTP_BASE_URL_OVERRIDES="https://vpic.nhtsa.dot.gov=http://127.0.0.1:8081"
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import httpx
+
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "10"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "50"))
+HTTP_HOST_CONCURRENCY = int(os.getenv("HTTP_HOST_CONCURRENCY", "8"))
+
+# How long a request waits for one of its host's HTTP_HOST_CONCURRENCY slots
+HTTP_HOST_WAIT_SECONDS = float(os.getenv("HTTP_HOST_WAIT_SECONDS", "30"))
+
+# RETRIES
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.2"))
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "2"))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# CIRCUIT BREAKER
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+
+
+class CircuitOpenError(Exception):
+    """Raised without touching the network while a host's circuit is open."""
+
+
+class HostBusyError(Exception):
+    """Raised when no per-host slot frees up within HTTP_HOST_WAIT_SECONDS."""
+
+
+def _parse_overrides(raw: str) -> dict:
+    overrides = {}
+    for pair in raw.split(","):
+        if "=" in pair:
+            original, replacement = pair.split("=", 1)
+            overrides[original.strip().rstrip("/")] = replacement.strip().rstrip("/")
+    return overrides
+
+
+_base_url_overrides = _parse_overrides(os.getenv("HTTP_BASE_URL_OVERRIDES", ""))
+
+
+def set_base_url_override(original: str, replacement: str | None) -> None:
+    """Point a base URL at another server (tests / local stubs); None removes it."""
+    original = original.rstrip("/")
+    if replacement is None:
+        _base_url_overrides.pop(original, None)
+    else:
+        _base_url_overrides[original] = replacement.rstrip("/")
+
+
+def resolve_url(url: str) -> str:
+    for original, replacement in _base_url_overrides.items():
+        if url.startswith(original):
+            return replacement + url[len(original):]
+    return url
+
+
+class CircuitBreaker:
+    """
+    Opens after CIRCUIT_FAILURE_THRESHOLD consecutive failures; while open
+    calls fail fast. After CIRCUIT_RESET_SECONDS one trial call is let
+    through (half-open) and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_seconds: float = CIRCUIT_RESET_SECONDS):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half-open"
+        return "open"
+
+    def before_call(self, host: str) -> bool:
+        """True when this call is the half-open trial."""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return False
+            if state == "half-open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            raise CircuitOpenError(f"Circuit open for {host}")
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.trial_in_flight or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self.trial_in_flight = False
+
+    def release_trial(self) -> None:
+        # The call ended without an outcome (unexpected error): let another trial through
+        with self._lock:
+            self.trial_in_flight = False
+
+
+# PER-HOST STATE
+
+_hosts_lock = threading.Lock()
+_breakers: dict[str, CircuitBreaker] = {}
+_sync_limits: dict[str, threading.BoundedSemaphore] = {}
+_async_limits: dict[tuple[int, str], asyncio.BoundedSemaphore] = {}
+
+
+def _host(url: str) -> str:
+    return urlsplit(url).netloc
+
+
+def _breaker(host: str) -> CircuitBreaker:
+    with _hosts_lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker()
+        return _breakers[host]
+
+
+def _sync_limit(host: str) -> threading.BoundedSemaphore:
+    with _hosts_lock:
+        if host not in _sync_limits:
+            _sync_limits[host] = threading.BoundedSemaphore(HTTP_HOST_CONCURRENCY)
+        return _sync_limits[host]
+
+
+def _async_limit(host: str) -> asyncio.BoundedSemaphore:
+    # asyncio primitives belong to one loop
+    key = (id(asyncio.get_running_loop()), host)
+    with _hosts_lock:
+        if key not in _async_limits:
+            _async_limits[key] = asyncio.BoundedSemaphore(HTTP_HOST_CONCURRENCY)
+        return _async_limits[key]
+
+
+def _host_busy(host: str) -> HostBusyError:
+    return HostBusyError(
+        f"No free connection slot for {host} after {HTTP_HOST_WAIT_SECONDS}s "
+        f"(HTTP_HOST_CONCURRENCY={HTTP_HOST_CONCURRENCY})"
+    )
+
+
+def _backoff(attempt: int) -> float:
+    # Full jitter: spreads retries from many workers hitting the same outage
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)))
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS)
+
+
+# CLIENTS
+
+_sync_client = None
+_clients_lock = threading.Lock()
+
+
+def _get_sync_client() -> httpx.Client:
+    global _sync_client
+    with _clients_lock:
+        if _sync_client is None:
+            _sync_client = httpx.Client(timeout=_timeout(), limits=_limits())
+        return _sync_client
+
+
+_async_clients: dict[int, httpx.AsyncClient] = {}
+
+
+def _get_async_client() -> httpx.AsyncClient:
+    key = id(asyncio.get_running_loop())
+    with _clients_lock:
+        if key not in _async_clients:
+            _async_clients[key] = httpx.AsyncClient(timeout=_timeout(), limits=_limits())
+        return _async_clients[key]
+
+
+def _should_retry(response: httpx.Response | None, attempt: int, retries: int) -> bool:
+    if attempt >= retries:
+        return False
+    return response is None or response.status_code in RETRY_STATUSES
+
+
+def request(method: str, url: str, retries: int | None = None, **kwargs) -> httpx.Response:
+    """
+    Blocking request through the shared pool. Transport errors and
+    429/5xx responses are retried (GET by default; pass retries for other
+    idempotent calls). Returns the last response, or raises the last
+    transport error / CircuitOpenError / HostBusyError. The circuit
+    breaker sees one outcome per call, after the retries.
+    """
+    url = resolve_url(url)
+    host = _host(url)
+    breaker = _breaker(host)
+    if retries is None:
+        retries = HTTP_RETRIES if method.upper() == "GET" else 0
+
+    trial = breaker.before_call(host)
+    recorded = False
+
+    try:
+        attempt = 0
+        while True:
+            response = None
+            error = None
+
+            limit = _sync_limit(host)
+            if not limit.acquire(timeout=HTTP_HOST_WAIT_SECONDS):
+                raise _host_busy(host)
+            try:
+                response = _get_sync_client().request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                error = e
+            finally:
+                limit.release()
+
+            if not _should_retry(response, attempt, retries):
+                if error is None and response.status_code < 500:
+                    breaker.record_success()
+                else:
+                    breaker.record_failure()
+                recorded = True
+
+                if error is not None:
+                    raise error
+                return response
+
+            delay = _backoff(attempt)
+            print(f"↻ Retrying {method} {host} in {delay:.2f}s (attempt {attempt + 1}/{retries})")
+            time.sleep(delay)
+            attempt += 1
+
+    finally:
+        # e.g. an invalid URL or a bug in the caller's kwargs: must not leave a half-open trial stuck
+        if trial and not recorded:
+            breaker.release_trial()
+
+
+async def arequest(method: str, url: str, retries: int | None = None, **kwargs) -> httpx.Response:
+    """Async counterpart of request(), same retry and breaker rules."""
+    url = resolve_url(url)
+    host = _host(url)
+    breaker = _breaker(host)
+    if retries is None:
+        retries = HTTP_RETRIES if method.upper() == "GET" else 0
+
+    trial = breaker.before_call(host)
+    recorded = False
+
+    try:
+        attempt = 0
+        while True:
+            response = None
+            error = None
+
+            limit = _async_limit(host)
+            try:
+                await asyncio.wait_for(limit.acquire(), HTTP_HOST_WAIT_SECONDS)
+            except asyncio.TimeoutError:
+                raise _host_busy(host) from None
+            try:
+                response = await _get_async_client().request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                error = e
+            finally:
+                limit.release()
+
+            if not _should_retry(response, attempt, retries):
+                if error is None and response.status_code < 500:
+                    breaker.record_success()
+                else:
+                    breaker.record_failure()
+                recorded = True
+
+                if error is not None:
+                    raise error
+                return response
+
+            delay = _backoff(attempt)
+            print(f"↻ Retrying {method} {host} in {delay:.2f}s (attempt {attempt + 1}/{retries})")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    finally:
+        # Also covers cancellation while waiting on the host
+        if trial and not recorded:
+            breaker.release_trial()
+
+
+def get(url: str, **kwargs) -> httpx.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> httpx.Response:
+    return request("POST", url, **kwargs)
+
+
+async def aget(url: str, **kwargs) -> httpx.Response:
+    return await arequest("GET", url, **kwargs)
+
+
+async def apost(url: str, **kwargs) -> httpx.Response:
+    return await arequest("POST", url, **kwargs)
+
+
+def stats() -> dict:
+    with _hosts_lock:
+        return {
+            host: {"state": breaker.state, "consecutive_failures": breaker.failures}
+            for host, breaker in _breakers.items()
+        }
@@ -0,0 +1,107 @@
+import os
+import threading
+from collections import OrderedDict
+
+from models import LeaseAnalysis
+from text_condenser import estimate_tokens
+
+# Fallback for records without a stored digest (one per record,
+# rebuilt when car history lands)
+LEASE_DIGEST_CACHE_SIZE = int(os.getenv("LEASE_DIGEST_CACHE_SIZE", "1000"))
+
+# Long free-text clauses are cut to keep the digest small
+DIGEST_TEXT_MAX_CHARS = 200
+
+_digests: OrderedDict = OrderedDict()
+_digests_lock = threading.Lock()
+
+
+def _label(key: str) -> str:
+    return key.replace("_", " ").capitalize()
+
+
+def _short(value) -> str:
+    text = " ".join(str(value).split())
+    if len(text) > DIGEST_TEXT_MAX_CHARS:
+        text = text[:DIGEST_TEXT_MAX_CHARS].rstrip() + "..."
+    return text
+
+
+def _section(title: str, values: dict) -> str | None:
+    items = [f"{_label(key)}: {_short(value)}" for key, value in values.items() if value not in (None, "", [], {})]
+    if not items:
+        return None
+    return f"{title}: " + "; ".join(items)
+
+
+def build_lease_digest(record: LeaseAnalysis) -> str:
+    """
+    Compact plain-text summary of a lease for chat prompts: only the
+    fields that are present, one line per section.
+    """
+    analysis = record.analysis_result or {}
+    fairness = record.fairness_analysis or {}
+    history = record.car_full_history or {}
+    vehicle_api = record.vehicle_api_data or {}
+
+    vehicle = dict(analysis.get("vehicle_details") or {})
+    vehicle.pop("vehicle_id_number", None)
+    for key, fallback in (("maker", "make"), ("model", "model"), ("year", "year")):
+        if not vehicle.get(key):
+            vehicle[key] = history.get(fallback) or vehicle_api.get(fallback)
+
+    lines = [
+        _section("Parties", analysis.get("parties") or {}),
+        _section("Vehicle", vehicle),
+        _section("Lease", analysis.get("lease_details") or {}),
+        _section("Financials", analysis.get("financials") or {}),
+        _section("Penalties", analysis.get("penalties") or {}),
+        _section("Termination", {"clause": analysis.get("termination_clause")}),
+        _section("Fairness", {
+            "score": fairness.get("fairness_score"),
+            "verdict": fairness.get("fairness_verdict"),
+            "red_flags": " | ".join(fairness.get("red_flags") or []),
+        }),
+        _section("Car history", {
+            key: history.get(key)
+            for key in ("status", "owners", "accidental", "flood_damage", "insurance_claims", "stolen")
+        }) if history else "Car history: not available yet",
+    ]
+
+    return "\n".join(line for line in lines if line)
+
+
+def refresh_lease_digest(record: LeaseAnalysis) -> str:
+    """
+    (Re)build the digest and store it on the record. Called at upload and
+    when the background car history lands; the caller commits.
+    """
+    digest = build_lease_digest(record)
+    record.context_digest = digest
+    record.context_digest_tokens = estimate_tokens(digest)
+    return digest
+
+
+def get_lease_digest(record: LeaseAnalysis) -> str:
+    """Stored digest, or an in-memory one for records that predate the column."""
+    if record.context_digest:
+        return record.context_digest
+
+    # Car history arrives after upload, so it is part of the key
+    key = (record.id, record.car_full_history is not None)
+
+    with _digests_lock:
+        digest = _digests.get(key)
+        if digest is not None:
+            _digests.move_to_end(key)
+            return digest
+
+    digest = build_lease_digest(record)
+
+    with _digests_lock:
+        _digests[key] = digest
+        _digests.pop((record.id, not key[1]), None)
+        while len(_digests) > LEASE_DIGEST_CACHE_SIZE:
+            _digests.popitem(last=False)
+
+    return digest
@@ -1,13 +1,257 @@
-from groq import Groq
+import hashlib
+import json
 import os
 import re
+from disk_cache import DiskCache
+import groq_client
+from groq_client import LLM_MODEL
+from rule_extractor import (
+    RULE_MIN_CONFIDENCE,
+    extract_lease_fields,
+    field_paths,
+    get_field,
+    schema_for,
+    set_field,
+)
+from text_condenser import CHARS_PER_TOKEN, condense_lease_text, estimate_tokens
 
-client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+# Bump whenever the extraction prompt changes, so cached answers are not reused
+PROMPT_VERSION = 2
+
+# LLM EXTRACTION CACHE (keyed by normalized document text)
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", os.path.join("cache", "llm"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+
+llm_cache = DiskCache(LLM_CACHE_DIR, LLM_CACHE_MAX_ENTRIES)
+
+# CHUNKED EXTRACTION
+# Documents above this size are split into overlapping sections that are
+# extracted in parallel and merged, so latency stays flat with length
+LLM_CHUNK_TOKENS = int(os.getenv("LLM_CHUNK_TOKENS", "3000"))
+LLM_CHUNK_OVERLAP_TOKENS = int(os.getenv("LLM_CHUNK_OVERLAP_TOKENS", "200"))
+
+# Chat answers stay deterministic, which also lets identical questions coalesce
+CHAT_TEMPERATURE = 0.0
+
+
+def _normalize_text(text: str) -> str:
+    # Whitespace-only differences (OCR spacing, line breaks) must not miss the cache
+    return " ".join(text.split())
+
+
+def llm_cache_key(text: str, fields: list[str] | None = None) -> str:
+    # The same document asks for different fields if the rules change
+    requested = ",".join(fields) if fields else "*"
+    raw = f"{PROMPT_VERSION}|{LLM_MODEL}|{requested}|{_normalize_text(text)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def analyze_lease(text: str, user_key=None):
+    """
+    Extract the lease JSON for a document. The text is condensed first and
+    run through the rule extractor; the LLM is only asked for fields the
+    rules could not fill confidently, and those answers are cached.
+    """
+    text, stats = condense_lease_text(text)
+    print(
+        f"PROMPT CONDENSED: {stats['original_tokens']} -> {stats['condensed_tokens']} tokens "
+        f"({stats['saved_pct']}% saved)"
+    )
+
+    result, confidences = extract_lease_fields(text)
+    missing = [
+        path for path in field_paths()
+        if confidences.get(path, 0.0) < RULE_MIN_CONFIDENCE
+    ]
+    print(f"RULE EXTRACTOR: {len(confidences)} fields found, {len(missing)} left for the LLM")
+
+    if not missing:
+        print("✅ All fields extracted by rules, skipping LLM")
+        return json.dumps(result)
+
+    if estimate_tokens(text) > LLM_CHUNK_TOKENS:
+        cleaned = _extract_chunked(text, missing, user_key)
+    else:
+        cleaned = _extract_single(text, missing, user_key)
+
+    return _merge_llm_fields(result, missing, cleaned)
+
+
+def _cache_answer(key: str, cleaned: str) -> None:
+    # Only cache answers that parse, a bad completion should be retried
+    try:
+        json.loads(cleaned)
+        llm_cache.set(key, {"output": cleaned})
+    except ValueError:
+        pass
+
+
+def _extract_single(text: str, missing: list[str], user_key=None) -> str:
+    key = llm_cache_key(text, missing)
+
+    cached = llm_cache.get(key)
+    if cached is not None:
+        print("✅ Using cached LLM extraction")
+        return cached["output"]
+
+    cleaned = _complete(_extraction_prompt(text, schema_for(missing)), user_key=user_key)
+    _cache_answer(key, cleaned)
+    return cleaned
+
+
+# CHUNKED EXTRACTION (long contracts)
+
+def split_into_chunks(text: str, max_tokens: int = None, overlap_tokens: int = None) -> list[str]:
+    """
+    Split text on line boundaries into chunks of at most max_tokens,
+    repeating the last overlap_tokens of each chunk at the start of the
+    next so values broken across a boundary are still seen whole.
+    """
+    max_tokens = max_tokens or LLM_CHUNK_TOKENS
+    overlap_tokens = LLM_CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+    max_chars = max_tokens * CHARS_PER_TOKEN
+
+    lines = []
+    for line in text.splitlines():
+        # A single huge OCR line still has to fit in a chunk
+        while len(line) > max_chars:
+            lines.append(line[:max_chars])
+            line = line[max_chars:]
+        lines.append(line)
+
+    chunks = []
+    current = []
+    current_tokens = 0
+
+    for line in lines:
+        line_tokens = estimate_tokens(line) + 1
+        if current and current_tokens + line_tokens > max_tokens:
+            chunks.append("\n".join(current))
+
+            overlap = []
+            overlap_size = 0
+            for previous in reversed(current):
+                size = estimate_tokens(previous) + 1
+                if overlap_size + size > overlap_tokens:
+                    break
+                overlap.insert(0, previous)
+                overlap_size += size
+
+            current = overlap
+            current_tokens = overlap_size
+
+        current.append(line)
+        current_tokens += line_tokens
+
+    if current:
+        chunks.append("\n".join(current))
+
+    return chunks
+
+
+def _extract_chunked(text: str, missing: list[str], user_key=None) -> str:
+    chunks = split_into_chunks(text)
+    total = len(chunks)
+    print(f"CHUNKED EXTRACTION: {estimate_tokens(text)} tokens in {total} chunks")
+
+    schema = schema_for(missing)
+    keys = [llm_cache_key(chunk, missing) for chunk in chunks]
+    outputs = [None] * total
+    pending = {}
+
+    # Map: uncached chunks are all submitted to the async client at once
+    for index, chunk in enumerate(chunks):
+        cached = llm_cache.get(keys[index])
+        if cached is not None:
+            outputs[index] = cached["output"]
+            continue
+        prompt = _extraction_prompt(chunk, schema, (index + 1, total))
+        pending[index] = groq_client.submit(
+            [{"role": "user", "content": prompt}], user_key=user_key
+        )
+
+    for index, future in pending.items():
+        outputs[index] = _clean_output(future.result())
+        _cache_answer(keys[index], outputs[index])
+
+    partials = []
+    for output in outputs:
+        try:
+            data = json.loads(output)
+        except ValueError:
+            continue
+        if isinstance(data, dict):
+            partials.append(data)
+
+    if not partials:
+        # Nothing usable, surface the raw completion like the single-prompt path
+        return outputs[0]
+
+    # Reduce
+    return json.dumps(merge_partial_extractions(partials, missing))
+
+
+def _vote_key(value) -> str:
+    # "INR 6,04,800" and "inr 604800" are the same answer
+    return re.sub(r"[\s,.]", "", str(value)).lower()
+
+
+def merge_partial_extractions(partials: list[dict], paths: list[str]) -> dict:
+    """
+    Merge per-chunk answers into one schema. For every field the value
+    reported by the most chunks wins; ties go to the earliest chunk since
+    lease summaries and definitions come first.
+    """
+    merged = schema_for(paths)
+
+    for path in paths:
+        votes = {}
+        for position, partial in enumerate(partials):
+            value = get_field(partial, path)
+            if value is None or value == "":
+                continue
+            key = _vote_key(value)
+            if key not in votes:
+                votes[key] = {"value": value, "count": 0, "first": position}
+            votes[key]["count"] += 1
+
+        if votes:
+            best = max(votes.values(), key=lambda vote: (vote["count"], -vote["first"]))
+            set_field(merged, path, best["value"])
+
+    return merged
+
+
+def _merge_llm_fields(result: dict, missing: list[str], cleaned: str):
+    try:
+        llm_data = json.loads(cleaned)
+    except ValueError:
+        # Let the caller report the bad completion as before
+        return cleaned
+
+    if not isinstance(llm_data, dict):
+        return cleaned
+
+    for path in missing:
+        value = get_field(llm_data, path)
+        # Low-confidence rule values stay as a fallback when the LLM has nothing
+        if value is not None:
+            set_field(result, path, value)
+
+    return json.dumps(result)
+
+
+def _extraction_prompt(text: str, schema: dict, section: tuple[int, int] | None = None) -> str:
+    scope = ""
+    if section:
+        scope = (
+            f"\nThe text below is section {section[0]} of {section[1]} of a longer contract. "
+            "Return null for anything that does not appear in this section.\n"
+        )
 
-def analyze_lease(text: str):
     prompt = f"""
 You are a legal document analyzer.
-
+{scope}
 CRITICAL RULES:
 1. If a value exists anywhere in the document text, you MUST extract it. DO NOT return null.
 2. Return null ONLY if the information truly does not appear in the document.
@@ -21,69 +265,53 @@ CRITICAL RULES:
 
 Return exactly this structure:
 
-{{
-  "parties": {{"lessor": null, "lessee": null}},
-  "lease_details": {{
-    "lease_duration": null,
-    "start_date": null,
-    "end_date": null,
-    "rent_amount": null,
-    "payment_terms": null
-  }},
-  "vehicle_details": {{
-    "maker": null,
-    "model": null,
-    "year": null,
-    "body_style": null,
-    "color": null,
-    "vehicle_id_number": null,
-    "registration_number": null
-  }},
-  "financials": {{
-    "base_monthly_payment": null,
-    "monthly_tax": null,
-    "total_monthly_payment": null,
-    "total_of_payments": null,
-    "residual_value": null,
-    "purchase_option_price": null
-  }},
-  "penalties": {{
-    "early_termination_charge": null,
-    "late_payment_fee": null,
-    "excess_wear_charges": null
-  }},
-  "termination_clause": null
-}}
+{json.dumps(schema, indent=2)}
 
 Document text:
 {text}
 """
 
-    response = client.chat.completions.create(
-        model="llama-3.1-8b-instant",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.0
-    )
+    return prompt
 
-    raw_output = response.choices[0].message.content
 
+def _clean_output(raw_output) -> str:
+    return re.sub(r"```json|```", "", str(raw_output)).strip()
 
-    cleaned = re.sub(r"```json|```", "", str(raw_output)).strip()
 
-    return cleaned
+def _complete(prompt: str, user_key=None) -> str:
+    raw_output = groq_client.complete(
+        [{"role": "user", "content": prompt}],
+        temperature=0.0,
+        user_key=user_key,
+    )
+
+    return _clean_output(raw_output)
+
+
+def _chat_messages(system_prompt: str, user_message: str) -> list[dict]:
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_message},
+    ]
 
 
-def chat_with_llm(system_prompt: str, user_message: str) -> str:
+def chat_with_llm(system_prompt: str, user_message: str, user_key=None) -> str:
     """
     Conversational LLM helper for chatbot.
-    Forces natural-language responses instead of JSON.
+    Plain chat completion, separate from the JSON extraction prompt.
     """
-    prompt = f"""
-{system_prompt}
+    reply = groq_client.complete(
+        _chat_messages(system_prompt, user_message),
+        temperature=CHAT_TEMPERATURE,
+        user_key=user_key,
+    )
+    return (reply or "").strip()
 
-User question:
-{user_message}
 
-Answer in plain English:
-"""
-    return analyze_lease(prompt)
+def stream_chat_with_llm(system_prompt: str, user_message: str, user_key=None):
+    """Same as chat_with_llm, but yields the reply token by token."""
+    return groq_client.stream(
+        _chat_messages(system_prompt, user_message),
+        temperature=CHAT_TEMPERATURE,
+        user_key=user_key,
+    )
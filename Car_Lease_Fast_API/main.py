@@ -1,27 +1,29 @@
 from email.mime import text
-from fastapi import FastAPI, File, UploadFile, Depends, HTTPException, status, BackgroundTasks
-import re
+from fastapi import FastAPI, File, UploadFile, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+import asyncio
 import json
-import shutil
+import time
 import os
+import uuid
 from fastapi.middleware.cors import CORSMiddleware
 from auth import router as auth_router
 from sqlalchemy.orm import Session, joinedload
-from datetime import datetime
-from llm_utils import analyze_lease
 from database import SessionLocal, engine, Base
-from models import User, LeaseAnalysis, DealerChatMessage, DealerStatus, Dealer
+from models import User, LeaseAnalysis, DealerChatMessage, DealerStatus, Dealer, UploadJob
 from auth import get_current_user
-from ocr_utils import extract_text
-from llm_utils import analyze_lease
-from fairness_utils import calculate_fairness
-from vin_utils import decode_vin
 from schemas import CarFullHistoryRequest, CarFullHistoryResponse
 from services.car_full_history_service import CarFullHistoryService
 from ai_chat import router as ai_chat_router
 from routes.dealer_chat import router as dealer_chat_router
-from price_estimator import estimate_car_price
 from dealer_auth import router as dealer_auth_router
+from upload_pipeline import UPLOAD_DIR, STAGE_PROGRESS, store_upload, submit_upload_job, start_job_recovery
+from routes.batch_upload import router as batch_upload_router
+from ocr_utils import ocr_cache
+from llm_utils import llm_cache
+import groq_client
+import http_client
 
 # Create DB tables
 Base.metadata.create_all(bind=engine)
@@ -39,23 +41,22 @@ app.include_router(dealer_chat_router, tags=["Dealer Chat"])
 app.include_router(auth_router, prefix="/auth", tags=["auth"])
 app.include_router(ai_chat_router, prefix="/chatbot", tags=["chatbot"])
 app.include_router(dealer_auth_router)
+app.include_router(batch_upload_router, tags=["Batch Upload"])
 
-UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-LAST_UPLOADED_FILE = None
 
+@app.on_event("startup")
+def recover_upload_jobs():
+    # Requeue uploads lost with a restarted or crashed worker, now and periodically
+    start_job_recovery()
 
-def extract_vin_from_text(text: str):
-    """
-    Extract VIN even if OCR breaks it with spaces or newlines.
-    """
-    cleaned = text.replace(" ", "").replace("\n", "").upper()
 
-    
-    pattern = r"[A-HJ-NPR-Z0-9]{17}"
-    match = re.search(pattern, cleaned)
-    return match.group(0) if match else None
+# Upload progress stream: DB poll interval and idle keep-alive interval (seconds)
+UPLOAD_EVENTS_POLL_INTERVAL = 0.5
+UPLOAD_EVENTS_KEEPALIVE = 10
+
+LAST_UPLOADED_FILE = None
 
 
 # Dependency
@@ -72,255 +73,190 @@ def root():
     return {"message": "Lease Document Analyzer API is running"}
 
 
-def fetch_and_store_car_history(record_id: int, vin: str):
-
-    db = SessionLocal()
-
-    try:
-        print(f"🌐 Background fetching car history for VIN: {vin}")
-
-        history_service = CarFullHistoryService()
-        car_history = history_service.fetch_full_history(vin)
-
-        record = db.query(LeaseAnalysis).filter(
-            LeaseAnalysis.id == record_id
-        ).first()
-
-        if record:
-            record.car_full_history = car_history
-            db.commit()
-
-        print("✅ Background car history saved")
-
-    except Exception as e:
-        print("❌ Background history fetch failed:", str(e))
-
-    finally:
-        db.close()
-
-
-
 @app.post("/upload")
-async def upload_file(
-    background_tasks: BackgroundTasks,
+def upload_file(
     file: UploadFile = File(...),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    # Save file uniquely
-    timestamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
-    unique_filename = f"{current_user.id}_{timestamp}_{file.filename}"
-    file_path = os.path.join(UPLOAD_DIR, unique_filename)
+    """
+    Store the upload and queue the analysis pipeline.
+    Poll GET /upload/{job_id} for progress and the final result.
+    """
+    # SAVE FILE FIRST, hashing it while it streams in (used for dedup + OCR cache)
+    unique_filename, content_hash = store_upload(current_user.id, file.filename, file.file)
 
-    # SAVE FILE FIRST (THIS WAS WRONG BEFORE)
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    job = UploadJob(
+        id=str(uuid.uuid4()),
+        user_id=current_user.id,
+        filename=file.filename,
+        stored_filename=unique_filename,
+        content_hash=content_hash,
+        status="queued",
+        stage="store",
+        progress=STAGE_PROGRESS["store"],
+    )
+    db.add(job)
+    db.commit()
 
-    original_filename = file.filename
+    submit_upload_job(job.id)
 
-    # EXTRACT TEXT USING OCR UTILS
-    extracted_text = extract_text(file_path)
+    return {
+        "message": "Lease upload queued for analysis",
+        "job_id": job.id,
+        "status": job.status,
+    }
 
-    print("EXTRACTED TEXT LENGTH:", len(extracted_text) if extracted_text else "NO TEXT")
 
-    if not extracted_text or len(extracted_text.strip()) == 0:
-        raise HTTPException(status_code=400, detail="No text extracted from PDF")
-    
-    # CHECK IF FILE ALREADY EXISTS FOR THIS USER
-    existing_record = (
-        db.query(LeaseAnalysis)
+@app.get("/upload/{job_id}")
+def get_upload_status(
+    job_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    job = (
+        db.query(UploadJob)
         .filter(
-            LeaseAnalysis.filename == original_filename,
-            LeaseAnalysis.user_id == current_user.id
+            UploadJob.id == job_id,
+            UploadJob.user_id == current_user.id
         )
         .first()
     )
 
-    if existing_record:
-        return {
-            "message": "Existing analysis found",
-            "record_id": existing_record.id,
-            "filename": existing_record.filename,
-            "vin": existing_record.vin,
-            "analysis_result": existing_record.analysis_result,
-            "fairness_analysis": existing_record.fairness_analysis,
-            "price_estimation": existing_record.price_estimation,  
-            "vehicle_api_data": existing_record.vehicle_api_data,
-            "car_full_history": existing_record.car_full_history
-        }
-
-    #  CALL GROQ ONCE (USING YOUR analyze_lease)
-    print("====== OCR EXTRACTED TEXT (FIRST 2000 CHARS) ======")
-    print(extracted_text[:2000])
-    print("====== END OCR TEXT ======")
-
-    raw_output = analyze_lease(extracted_text)
+    if not job:
+        raise HTTPException(status_code=404, detail="Upload job not found")
 
-    print("====== GROQ RAW OUTPUT ======")
-    print(raw_output)
-    print("====== END GROQ OUTPUT ======")
+    return upload_job_status(job)
 
 
-    print("GROQ RAW RESPONSE:", raw_output)
-
-    if not raw_output:
-        raise HTTPException(status_code=500, detail="Groq returned empty response")
+def upload_job_status(job: UploadJob) -> dict:
+    return {
+        "job_id": job.id,
+        "filename": job.filename,
+        "status": job.status,
+        "stage": job.stage,
+        "progress": job.progress,
+        "pages_done": job.pages_done,
+        "pages_total": job.pages_total,
+        "error": job.error,
+        "record_id": job.record_id,
+        "result": job.result if job.status == "completed" else None,
+    }
 
-    # CLEAN & PARSE JSON
-    cleaned = re.sub(r"```json|```", "", raw_output).strip()
 
+def _load_upload_job(job_id: str, user_id: int) -> dict | None:
+    db = SessionLocal()
     try:
-        parsed_json = json.loads(cleaned)
-
-        # Build summary from important fields
-        lease_details = parsed_json.get("lease_details", {})
-        financials = parsed_json.get("financials", {})
-        penalties = parsed_json.get("penalties", {})
-
-        summary_parts = []
-
-        if lease_details.get("start_date"):
-            summary_parts.append(f"Lease starts on {lease_details.get('start_date')}")
-
-        if lease_details.get("end_date"):
-            summary_parts.append(f"and ends on {lease_details.get('end_date')}")
-
-        if lease_details.get("lease_duration"):
-            summary_parts.append(f"for a duration of {lease_details.get('lease_duration')}")
-
-        summary = " ".join(summary_parts) if summary_parts else None
-
-        monthly_payment = financials.get("total_monthly_payment") or financials.get("base_monthly_payment")
-
-        # Build potential issues list from penalties
-        issues = []
-        for k, v in penalties.items():
-            if v:
-                issues.append(f"{k.replace('_', ' ').title()}: {v}")
-
-        # Simple negotiation tips (rule-based for now)
-        negotiation_tips = []
-
-        if monthly_payment:
-            negotiation_tips.append("Ask if the monthly payment can be reduced or fixed.")
-
-        if financials.get("residual_value"):
-            negotiation_tips.append("Negotiate the residual value at the end of lease.")
-
-        if penalties.get("early_termination_charge"):
-            negotiation_tips.append("Try to reduce early termination charges.")
-
-        print("MAPPED SUMMARY:", summary)
-        print("MAPPED MONTHLY PAYMENT:", monthly_payment)
-        print("MAPPED ISSUES:", issues)
-        print("MAPPED NEGOTIATION TIPS:", negotiation_tips)
-
-    except Exception as e:
-        print("JSON PARSE ERROR:", e)
-        print("RAW GROQ:", raw_output)
-        raise HTTPException(status_code=500, detail="Groq returned invalid JSON")
-
-    # EXTRACT VIN
-    vehicle_section = parsed_json.get("vehicle_details", {})
-    vin = vehicle_section.get("vehicle_id_number")
-
-    # Fallback: extract VIN from OCR text
-    if not vin:
-        vin = extract_vin_from_text(extracted_text)
-
-    # Validate VIN
-    if vin and len(vin) != 17:
-        vin = None
-
-    # DECODE VIN
-    vehicle_api_data = None
-    if vin:
-        try:
-            vehicle_api_data = decode_vin(vin)
-        except Exception as e:
-            vehicle_api_data = {"error": str(e)}
-
-    # FAIRNESS
-    fairness_result = calculate_fairness(parsed_json)
-
-    car_full_history = None
-
-    price_estimation = estimate_car_price(
-        vehicle_details=parsed_json.get("vehicle_details", {}),
-        car_history=car_full_history,
-        fairness_analysis=fairness_result,
-    )
-
-    # SMART CAR HISTORY FETCH (DB CACHE FIRST)
-    car_full_history = None
-
-    if vin:
+        job = (
+            db.query(UploadJob)
+            .filter(
+                UploadJob.id == job_id,
+                UploadJob.user_id == user_id
+            )
+            .first()
+        )
+        if job is None:
+            return None
+        return {**upload_job_status(job), "partial_result": job.partial_result or {}}
+    finally:
+        db.close()
 
-        # CHECK IF VIN HISTORY ALREADY EXISTS IN DB
-        existing_record = db.query(LeaseAnalysis).filter(
-            LeaseAnalysis.vin == vin,
-            LeaseAnalysis.car_full_history.isnot(None)
-        ).first()
 
-        if existing_record:
-            print("✅ Using cached car history from DB")
-            car_full_history = existing_record.car_full_history
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
 
-        else:
-            print("🌐 Fetching car history from API")
 
+# Partial result key -> event emitted the first time it appears
+PARTIAL_EVENTS = {
+    "analysis_result": "llm_extracted",
+    "vehicle_api_data": "vin_decoded",
+    "fairness_analysis": "fairness_computed",
+}
 
 
-    # STORE IN DB
-    record = LeaseAnalysis(
-        user_id=current_user.id,
-        filename=original_filename,
-        stored_filename=unique_filename,
-        analysis_result=parsed_json,
-        fairness_analysis=fairness_result,
-        price_estimation=price_estimation, 
-        vin=vin,
-        vehicle_api_data=vehicle_api_data,
-        car_full_history=car_full_history,
+@app.get("/upload/{job_id}/events")
+async def stream_upload_events(
+    job_id: str,
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Server-sent events for an upload job: stage changes, OCR page progress,
+    partial results (LLM extraction, VIN decode, fairness) and the final result.
+    """
+    user_id = current_user.id
+
+    if await run_in_threadpool(_load_upload_job, job_id, user_id) is None:
+        raise HTTPException(status_code=404, detail="Upload job not found")
+
+    async def events():
+        last_stage = None
+        last_pages = None
+        sent_partials = set()
+        last_sent = time.monotonic()
+
+        while True:
+            job = await run_in_threadpool(_load_upload_job, job_id, user_id)
+            if job is None:
+                return
+
+            messages = []
+
+            if job["stage"] != last_stage:
+                last_stage = job["stage"]
+                messages.append(_sse("stage", {"stage": job["stage"], "progress": job["progress"]}))
+
+            if job["pages_total"] and job["pages_done"] != last_pages:
+                last_pages = job["pages_done"]
+                messages.append(_sse("ocr_progress", {
+                    "pages_done": job["pages_done"],
+                    "pages_total": job["pages_total"],
+                }))
+
+            partial = job["partial_result"]
+            for key, event in PARTIAL_EVENTS.items():
+                if key in partial and key not in sent_partials:
+                    sent_partials.add(key)
+                    messages.append(_sse(event, partial))
+
+            if job["status"] == "completed":
+                messages.append(_sse("completed", job["result"]))
+            elif job["status"] == "failed":
+                messages.append(_sse("failed", {"error": job["error"]}))
+
+            for message in messages:
+                yield message
+
+            if job["status"] in ("completed", "failed"):
+                return
+
+            # SSE comment keeps proxies from closing an idle connection
+            if messages:
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= UPLOAD_EVENTS_KEEPALIVE:
+                last_sent = time.monotonic()
+                yield ": keep-alive\n\n"
+
+            await asyncio.sleep(UPLOAD_EVENTS_POLL_INTERVAL)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
 
-    print("===== ABOUT TO SAVE RECORD =====")
-    print("User ID:", current_user.id)
-    print("Filename:", original_filename)
-    print("VIN:", vin)
-    print("================================")
 
-
-    db.add(record)
-    db.commit()
-    print("===== RECORD SAVED ID =====", record.id)
-    db.refresh(record)
-
-    # RUN BACKGROUND CAR HISTORY FETCH
-    if vin and car_full_history is None:
-        background_tasks.add_task(
-            fetch_and_store_car_history,
-            record.id,
-            vin
-    )
-
-
-    # RETURN TO FLUTTER
+# Cache hit/miss counters (per API worker process)
+@app.get("/cache/stats")
+def get_cache_stats(current_user: User = Depends(get_current_user)):
     return {
-        "message": "Lease analysis completed and stored",
-        "record_id": record.id,
-        "filename": original_filename,
-        "vin": vin,
-        "analysis_result": parsed_json,
-        "fairness_analysis": fairness_result,
-        "vehicle_api_data": vehicle_api_data,
-        "car_full_history": car_full_history,
-        "price_estimation": price_estimation,
+        "ocr": ocr_cache.stats(),
+        "llm_extraction": llm_cache.stats(),
+        "llm_client": groq_client.stats(),
+        "http_circuits": http_client.stats(),
     }
 
 
-
 #  Car Full History API (JWT Protected)
 @app.post("/car-full-history", response_model=CarFullHistoryResponse)
 def get_car_full_history(
@@ -31,6 +31,7 @@ class LeaseAnalysis(Base):
 
     filename = Column(String(255), nullable=False)
     stored_filename = Column(String(255), nullable=True)
+    content_hash = Column(String(64), nullable=True, index=True)  # sha256 of the uploaded bytes
 
     analysis_result = Column(JSON)
     fairness_analysis = Column(JSON)
@@ -41,6 +42,10 @@ class LeaseAnalysis(Base):
     vehicle_api_data = Column(JSON, nullable=True)
     car_full_history: Mapped[dict | None] = mapped_column(JSON, nullable=True)
 
+    # Compact prompt context for the AI chat/negotiation endpoints
+    context_digest = Column(Text, nullable=True)
+    context_digest_tokens = Column(Integer, nullable=True)
+
     # Relationships
     dealer_chats = relationship(
     "DealerChatMessage",
@@ -93,3 +98,40 @@ class Dealer(Base):
         cascade="all, delete-orphan"
     )
 
+# UPLOAD JOB (async lease analysis pipeline)
+class UploadJob(Base):
+    __tablename__ = "upload_jobs"
+
+    id = Column(String(36), primary_key=True)  # uuid4
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    batch_id = Column(String(36), nullable=True, index=True)  # uuid4 shared by the files of one batch upload
+
+    filename = Column(String(255), nullable=False)
+    stored_filename = Column(String(255), nullable=False)
+    content_hash = Column(String(64), nullable=False)
+
+    status = Column(String(20), default="queued")  # queued | running | completed | failed
+    stage = Column(String(30), default="store")
+    progress = Column(Integer, default=0)
+    error = Column(Text, nullable=True)
+
+    # Live progress for the event stream
+    pages_done = Column(Integer, default=0)
+    pages_total = Column(Integer, nullable=True)
+    partial_result = Column(JSON, nullable=True)
+
+    record_id = Column(Integer, ForeignKey("lease_analyses.id"), nullable=True)
+    result = Column(JSON, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+# VIN DECODE CACHE (shared by all workers, decodes never change)
+class VinDecodeCache(Base):
+    __tablename__ = "vin_decode_cache"
+
+    vin = Column(String(17), primary_key=True)
+    results = Column(JSON, nullable=False)  # NHTSA decodevinvaluesextended Results[0]
+    fetched_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
@@ -1,10 +1,116 @@
+import hashlib
 import os
+import re
+import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import CancelledError, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from io import StringIO
+from typing import Callable, Iterable, Iterator
+import numpy as np
 import pytesseract
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
 from PIL import Image, ImageEnhance, ImageFilter
+from disk_cache import DiskCache
+
+try:
+    # Optional: in-process Tesseract engine (no subprocess / temp file per page)
+    import tesserocr
+except ImportError:
+    tesserocr = None
 
 pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
 
+# OCR ENGINE SETTINGS
+OCR_DPI = 300
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", os.cpu_count() or 1))
+OCR_MAX_PAGES = int(os.getenv("OCR_MAX_PAGES", "50"))
+OCR_RENDER_BATCH = int(os.getenv("OCR_RENDER_BATCH", "2"))
+# Rendered pages held per document: one per worker plus the next one queued
+OCR_MAX_IN_FLIGHT = int(os.getenv("OCR_MAX_IN_FLIGHT", str(OCR_WORKERS + 1)))
+
+# OCR WORKER POOL: workers keep a Tesseract engine loaded; the whole pool is
+# replaced after OCR_WORKER_MAX_JOBS pages per worker (not max_tasks_per_child,
+# which deadlocks the executor on Python 3.11, CPython gh-115634).
+# Worker processes are checked every OCR_HEALTH_CHECK_SECONDS
+OCR_WORKER_MAX_JOBS = int(os.getenv("OCR_WORKER_MAX_JOBS", "200"))
+OCR_HEALTH_CHECK_SECONDS = int(os.getenv("OCR_HEALTH_CHECK_SECONDS", "60"))
+
+# A page not done after this long means a hung worker: the pool is killed and the page resubmitted
+OCR_PAGE_TIMEOUT_SECONDS = float(os.getenv("OCR_PAGE_TIMEOUT_SECONDS", "120"))
+
+# Times a page is resubmitted after its pool broke before it is OCR'd in-process
+OCR_POOL_RESUBMITS = 2
+
+# TEXT LAYER FAST PATH (poppler's pdftotext, shipped alongside pdftoppm)
+PDFTOTEXT_CMD = os.getenv("PDFTOTEXT_CMD", "pdftotext")
+TEXT_LAYER_MIN_CHARS = 40
+TEXT_LAYER_MIN_ALNUM_RATIO = 0.5
+
+# ADAPTIVE DPI: low-DPI preview of every scanned page, then high-DPI OCR
+# only for the regions that hold the fields analyze_lease extracts
+OCR_ADAPTIVE = os.getenv("OCR_ADAPTIVE", "0") == "1"
+OCR_PREVIEW_DPI = int(os.getenv("OCR_PREVIEW_DPI", "100"))
+ROI_MARGIN_LINES = 2
+
+KEY_FIELD_PATTERN = re.compile(
+    r"(vin\b|vehicle\s+identification|chassis|lessor|lessee|monthly|payment|"
+    r"instal|rent|\binr\b|\brs\b|total|residual|purchase\s+option|date|commenc|"
+    r"duration|months|terminat|penalt|late\s+fee|wear|"
+    r"\d{1,2}[/-]\d{1,2}[/-]\d{2,4}|\d{1,3}(,\d{2,3})+)",
+    re.IGNORECASE,
+)
+
+# STRUCTURED RESULT: pages scoring below OCR_RETRY_BELOW_CONFIDENCE are
+# re-OCRed on their own at OCR_RETRY_DPI with Otsu thresholding
+OCR_RETRY_BELOW_CONFIDENCE = float(os.getenv("OCR_RETRY_BELOW_CONFIDENCE", "60"))
+OCR_RETRY_DPI = int(os.getenv("OCR_RETRY_DPI", "400"))
+OCR_LLM_MIN_LINE_CONFIDENCE = float(os.getenv("OCR_LLM_MIN_LINE_CONFIDENCE", "40"))
+TEXT_LAYER_CONFIDENCE = 100.0
+
+# IMAGE PREPROCESSING
+# "numpy" = single-buffer array pipeline, "pil" = original PIL filter chain
+OCR_PREPROCESSOR = os.getenv("OCR_PREPROCESSOR", "numpy")
+# "fixed" (150, same as the PIL chain), "otsu" or "adaptive"
+OCR_THRESHOLD_MODE = os.getenv("OCR_THRESHOLD_MODE", "fixed")
+BINARIZE_THRESHOLD = 150
+ADAPTIVE_BLOCK_SIZE = 31
+ADAPTIVE_OFFSET = 10
+PREPROCESS_STRIP_ROWS = 128
+
+# Bump whenever preprocessing changes output, so cached OCR is not reused
+PREPROCESS_VERSION = 3
+# Bump whenever the cached result layout changes
+OCR_RESULT_VERSION = 3
+
+# OCR RESULT CACHE (content-addressed)
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", os.path.join("cache", "ocr"))
+OCR_CACHE_MAX_ENTRIES = int(os.getenv("OCR_CACHE_MAX_ENTRIES", "2000"))
+
+ocr_cache = DiskCache(OCR_CACHE_DIR, OCR_CACHE_MAX_ENTRIES)
+
+TESSERACT_PSM = 4   # better for columns/tables
+TESSERACT_WHITELIST = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz.,:/()- "
+
+TESSERACT_CONFIG = (
+    "--oem 3 "
+    f"--psm {TESSERACT_PSM} "
+    "-c preserve_interword_spaces=1 "
+    "-c tessedit_char_whitelist="
+    f"{TESSERACT_WHITELIST}"
+)
+
+_ocr_pool = None
+_ocr_pool_lock = threading.Lock()
+_ocr_pool_checked_at = 0.0
+_ocr_pool_jobs = 0
+
+# Per-process Tesseract engine (tesserocr backend only)
+_tess_api = None
+
+
 def preprocess_image(img: Image.Image) -> Image.Image:
     # Convert to grayscale
     img = img.convert("L")
@@ -25,48 +131,793 @@ def preprocess_image(img: Image.Image) -> Image.Image:
 
     return img
 
-def extract_text(file_path: str) -> str:
-    ext = os.path.splitext(file_path)[1].lower()
+
+def _copy_border(src: np.ndarray, dst: np.ndarray) -> None:
+    dst[0, :] = src[0, :]
+    dst[-1, :] = src[-1, :]
+    dst[:, 0] = src[:, 0]
+    dst[:, -1] = src[:, -1]
+
+
+def _strip_neighbourhood_sum(src: np.ndarray, r0: int, r1: int, acc: np.ndarray, centre_weight: int) -> None:
+    # 3x3 sum of src rows r0..r1 (interior columns only) written into acc
+    w = src.shape[1]
+    np.multiply(src[r0:r1, 1:-1], centre_weight, out=acc, casting="unsafe")
+    for dy in (-1, 0, 1):
+        for dx in (0, 1, 2):
+            if dy == 0 and dx == 1:
+                continue
+            acc += src[r0 + dy:r1 + dy, dx:w - 2 + dx]
+
+
+def _sharpen_into(gray: np.ndarray, out: np.ndarray) -> None:
+    # ImageEnhance.Sharpness(2.0) == 2 * img - smooth(img), SMOOTH kernel weights sum to 13.
+    # Works in row strips so the int16 scratch buffer stays small.
+    h, w = gray.shape
+    _copy_border(gray, out)
+    scratch = np.empty((PREPROCESS_STRIP_ROWS, w - 2), dtype=np.int16)
+
+    for r0 in range(1, h - 1, PREPROCESS_STRIP_ROWS):
+        r1 = min(r0 + PREPROCESS_STRIP_ROWS, h - 1)
+        acc = scratch[:r1 - r0]
+        _strip_neighbourhood_sum(gray, r0, r1, acc, centre_weight=5)
+        acc += 6
+        acc //= 13
+        acc *= -1
+        acc += gray[r0:r1, 1:-1]
+        acc += gray[r0:r1, 1:-1]
+        np.clip(acc, 0, 255, out=acc)
+        out[r0:r1, 1:-1] = acc
+
+
+def _otsu_threshold(gray: np.ndarray) -> int:
+    hist = np.zeros(256, dtype=np.float64)
+    for r0 in range(0, gray.shape[0], PREPROCESS_STRIP_ROWS):
+        hist += np.bincount(gray[r0:r0 + PREPROCESS_STRIP_ROWS].ravel(), minlength=256)
+    levels = np.arange(256)
+
+    weight_bg = np.cumsum(hist)
+    weight_fg = weight_bg[-1] - weight_bg
+    mass_bg = np.cumsum(hist * levels)
+    mean_bg = mass_bg / np.maximum(weight_bg, 1)
+    mean_fg = (mass_bg[-1] - mass_bg) / np.maximum(weight_fg, 1)
+
+    between = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+    return int(np.argmax(between)) + 1
+
+
+def _adaptive_binarize(gray: np.ndarray, out: np.ndarray) -> None:
+    # White when brighter than the local mean minus an offset (integral image, row strips)
+    h, w = gray.shape
+    r = ADAPTIVE_BLOCK_SIZE // 2
+    integral = np.zeros((h + 1, w + 1), dtype=np.uint32)
+    for y in range(h):
+        np.cumsum(gray[y], dtype=np.uint32, out=integral[y + 1, 1:])
+        integral[y + 1, 1:] += integral[y, 1:]
+
+    x0 = np.clip(np.arange(w) - r, 0, w)
+    x1 = np.clip(np.arange(w) + r + 1, 0, w)
+    widths = (x1 - x0).astype(np.int64)
+
+    for r0 in range(0, h, PREPROCESS_STRIP_ROWS):
+        rows = np.arange(r0, min(r0 + PREPROCESS_STRIP_ROWS, h))
+        y0 = np.clip(rows - r, 0, h)[:, None]
+        y1 = np.clip(rows + r + 1, 0, h)[:, None]
+
+        top = integral[y0]
+        bottom = integral[y1]
+        local_sum = (
+            bottom[..., x1].astype(np.int64) - bottom[..., x0]
+            - top[..., x1] + top[..., x0]
+        )[:, 0, :]
+        area = (y1 - y0) * widths
+        out[rows] = gray[rows].astype(np.int64) * area >= local_sum - ADAPTIVE_OFFSET * area
+
+
+def preprocess_array(img: Image.Image, threshold_mode: str = OCR_THRESHOLD_MODE) -> Image.Image:
+    """
+    Array version of preprocess_image: contrast, sharpen, threshold and
+    median denoise on two reused page buffers instead of one new
+    full-size image per PIL pass.
+    """
+    gray = np.array(img.convert("L"), dtype=np.uint8)
+
+    # Contrast x2 around the mean grey level (same as ImageEnhance.Contrast), via LUT in place
+    mean = int(gray.mean() + 0.5)
+    lut = np.clip(mean + 2 * (np.arange(256) - mean), 0, 255).astype(np.uint8)
+    for r0 in range(0, gray.shape[0], PREPROCESS_STRIP_ROWS):
+        strip = gray[r0:r0 + PREPROCESS_STRIP_ROWS]
+        strip[...] = lut[strip]
+
+    sharp = np.empty_like(gray)
+    _sharpen_into(gray, sharp)
+
+    # Binarize in place (1 = white)
+    white = sharp.view(np.bool_)
+    if threshold_mode == "otsu":
+        np.greater_equal(sharp, _otsu_threshold(sharp), out=white)
+    elif threshold_mode == "adaptive":
+        _adaptive_binarize(sharp, white)
+    else:
+        np.greater_equal(sharp, BINARIZE_THRESHOLD, out=white)
+
+    # Median then threshold == threshold then median, so the 3x3 median
+    # becomes a majority vote on the binary image (reusing the gray buffer).
+    h = gray.shape[0]
+    votes = gray
+    _copy_border(sharp, votes)
+    for r0 in range(1, h - 1, PREPROCESS_STRIP_ROWS):
+        r1 = min(r0 + PREPROCESS_STRIP_ROWS, h - 1)
+        acc = votes[r0:r1, 1:-1]
+        _strip_neighbourhood_sum(sharp, r0, r1, acc, centre_weight=1)
+        np.greater_equal(acc, 5, out=acc.view(np.bool_))
+
+    votes *= 255
+    return Image.fromarray(votes, mode="L")
+
+
+def _get_tess_api():
+    """
+    Lazily load one Tesseract engine per process and keep it for every page.
+    Returns None when tesserocr is not installed (pytesseract fallback).
+    """
+    global _tess_api
+    if tesserocr is None:
+        return None
+
+    if _tess_api is None:
+        api = tesserocr.PyTessBaseAPI(
+            lang="eng",
+            psm=tesserocr.PSM(TESSERACT_PSM),
+            oem=tesserocr.OEM.DEFAULT,
+        )
+        api.SetVariable("preserve_interword_spaces", "1")
+        api.SetVariable("tessedit_char_whitelist", TESSERACT_WHITELIST)
+        _tess_api = api
+    return _tess_api
+
+
+def _init_ocr_worker() -> None:
+    # Pool initializer: pay the engine load once per worker, not once per page
+    _get_tess_api()
+
+
+def _new_ocr_pool() -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(
+        max_workers=OCR_WORKERS,
+        initializer=_init_ocr_worker,
+    )
+
+
+def _recycle_ocr_pool(pool: ProcessPoolExecutor | None = None, kill: bool = False) -> None:
+    """
+    Drop a broken pool so the next call starts fresh workers. Only the
+    given pool is replaced (concurrent callers may already have swapped
+    it), and pending futures are never cancelled: other documents' pages
+    either finish or fail with BrokenProcessPool and are resubmitted.
+    kill terminates the workers too (a hung worker never exits on its own).
+    """
+    global _ocr_pool
+    with _ocr_pool_lock:
+        if _ocr_pool is None or (pool is not None and _ocr_pool is not pool):
+            return
+        old_pool, _ocr_pool = _ocr_pool, None
+
+    if kill:
+        for process in dict(getattr(old_pool, "_processes", None) or {}).values():
+            process.terminate()
+    old_pool.shutdown(wait=False, cancel_futures=False)
+
+
+def _pool_is_broken(pool: ProcessPoolExecutor) -> bool:
+    if getattr(pool, "_broken", False):
+        return True
+
+    # Workers never exit while their pool is in use, any exit code means one died
+    processes = dict(getattr(pool, "_processes", None) or {})
+    return any(process.exitcode is not None for process in processes.values())
+
+
+def ocr_pool_healthy() -> bool:
+    """
+    Check the pool without queueing work behind real pages: it is only
+    recycled when it is marked broken or a worker process died.
+    """
+    global _ocr_pool_checked_at
+    _ocr_pool_checked_at = time.monotonic()
+
+    pool = _ocr_pool
+    if pool is None or not _pool_is_broken(pool):
+        return True
+
+    print("OCR pool has a dead worker, recycling")
+    _recycle_ocr_pool(pool)
+    return False
+
+
+def _submit_ocr_job(fn: Callable, item) -> tuple[ProcessPoolExecutor, object]:
+    """
+    Submit one page to the shared OCR process pool (one per API worker),
+    creating it lazily. After OCR_WORKER_MAX_JOBS pages per worker the
+    pool is retired (its queued pages still finish) and a fresh one started.
+    Submitting under the lock means no other thread can retire the pool
+    in between. Returns (pool, future).
+    """
+    global _ocr_pool, _ocr_pool_jobs
+    if _ocr_pool is not None and time.monotonic() - _ocr_pool_checked_at > OCR_HEALTH_CHECK_SECONDS:
+        ocr_pool_healthy()
+
+    with _ocr_pool_lock:
+        if _ocr_pool is not None and _ocr_pool_jobs >= OCR_WORKER_MAX_JOBS * OCR_WORKERS:
+            print(f"Retiring OCR pool after {_ocr_pool_jobs} pages")
+            _ocr_pool.shutdown(wait=False, cancel_futures=False)
+            _ocr_pool = None
+
+        if _ocr_pool is None:
+            _ocr_pool = _new_ocr_pool()
+            _ocr_pool_jobs = 0
+
+        _ocr_pool_jobs += 1
+        return _ocr_pool, _ocr_pool.submit(fn, item)
+
+
+def _parse_tsv(tsv: str) -> dict[str, list]:
+    # Tesseract TSV -> same column dict as pytesseract.Output.DICT
+    columns = [
+        "level", "page_num", "block_num", "par_num", "line_num", "word_num",
+        "left", "top", "width", "height", "conf", "text",
+    ]
+    data = {c: [] for c in columns}
+
+    for row in StringIO(tsv):
+        fields = row.rstrip("\n").split("\t")
+        if len(fields) < len(columns) or fields[0] == "level":
+            continue
+        for c, value in zip(columns, fields):
+            if c == "text":
+                data[c].append(value)
+            elif c == "conf":
+                data[c].append(float(value))
+            else:
+                data[c].append(int(value))
+
+    return data
+
+
+def _image_to_data(img: Image.Image) -> dict[str, list]:
+    api = _get_tess_api()
+    if api is None:
+        tsv = pytesseract.image_to_data(img, config=TESSERACT_CONFIG)
+    else:
+        api.SetImage(img)
+        tsv = api.GetTSVText(0)
+    return _parse_tsv(tsv)
+
+
+def _preprocess(img: Image.Image) -> Image.Image:
+    if OCR_PREPROCESSOR == "numpy":
+        return preprocess_array(img)
+    return preprocess_image(img)
+
+
+def _lines_from_data(data: dict[str, list], scale: float = 1.0, offset_top: int = 0) -> list[dict]:
+    """
+    Group Tesseract words into lines (reading order) with bounding boxes
+    [left, top, right, bottom] and confidences. Boxes are scaled and shifted
+    so every line on a page shares one coordinate system.
+    """
+    lines = {}
+    for i, word in enumerate(data["text"]):
+        if not word.strip():
+            continue
+
+        left = int(data["left"][i] * scale)
+        top = int(data["top"][i] * scale) + offset_top
+        right = left + int(data["width"][i] * scale)
+        bottom = top + int(data["height"][i] * scale)
+
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        lines.setdefault(key, []).append({
+            "text": word,
+            "confidence": data["conf"][i],
+            "bbox": [left, top, right, bottom],
+        })
+
+    result = []
+    for words in lines.values():
+        confidences = [w["confidence"] for w in words if w["confidence"] >= 0]
+        result.append({
+            "text": " ".join(w["text"] for w in words),
+            "confidence": round(sum(confidences) / len(confidences), 1) if confidences else 0.0,
+            "bbox": [
+                min(w["bbox"][0] for w in words),
+                min(w["bbox"][1] for w in words),
+                max(w["bbox"][2] for w in words),
+                max(w["bbox"][3] for w in words),
+            ],
+            "words": words,
+        })
+    return result
+
+
+def _page_result(lines: list[dict], source: str, text: str | None = None) -> dict:
+    confidences = [l["confidence"] for l in lines]
+    return {
+        "source": source,
+        "confidence": round(sum(confidences) / len(confidences), 1) if confidences else 0.0,
+        "text": text if text is not None else "\n".join(l["text"] for l in lines),
+        "lines": lines,
+    }
+
+
+def _ocr_page(img: Image.Image) -> dict:
+    # Runs inside a pool worker, must stay a top-level function
+    return _page_result(_lines_from_data(_image_to_data(_preprocess(img))), "ocr")
+
+
+def _ocr_page_retry(img: Image.Image) -> dict:
+    processed = preprocess_array(img, threshold_mode="otsu")
+    return _page_result(_lines_from_data(_image_to_data(processed)), "ocr_retry")
+
+
+def pdf_total_pages(file_path: str) -> int:
+    return int(pdfinfo_from_path(file_path).get("Pages", 0))
+
+
+def pdf_page_count(file_path: str) -> int:
+    # Pages that are processed: at most OCR_MAX_PAGES
+    return min(pdf_total_pages(file_path), OCR_MAX_PAGES)
+
+
+def _page_runs(page_numbers: list[int]) -> Iterator[tuple[int, int]]:
+    # Group page numbers into consecutive (first, last) runs of at most OCR_RENDER_BATCH
+    run_start = run_end = None
+    for n in page_numbers:
+        if run_start is not None and n == run_end + 1 and n - run_start < OCR_RENDER_BATCH:
+            run_end = n
+            continue
+        if run_start is not None:
+            yield run_start, run_end
+        run_start = run_end = n
+    if run_start is not None:
+        yield run_start, run_end
+
+
+def iter_pdf_pages(
+    file_path: str,
+    dpi: int = OCR_DPI,
+    page_numbers: list[int] | None = None,
+) -> Iterator[Image.Image]:
+    """
+    Render a PDF a few pages at a time instead of loading every page bitmap.
+    Only OCR_RENDER_BATCH pages are materialized per poppler call, rendered
+    as grayscale (a third of the RGB size; OCR converts to grayscale anyway).
+    page_numbers (1-based) restricts rendering to those pages.
+    """
+    if page_numbers is None:
+        page_numbers = list(range(1, pdf_page_count(file_path) + 1))
+
+    for first_page, last_page in _page_runs(page_numbers):
+        batch = convert_from_path(
+            file_path,
+            dpi=dpi,
+            first_page=first_page,
+            last_page=last_page,
+            grayscale=True,
+        )
+        yield from batch
+
+
+def extract_text_layer(file_path: str, page_count: int) -> list[str]:
+    """
+    Pull the embedded text of every page with pdftotext (no rasterizing).
+    Returns one string per page; pages without a text layer come back empty.
+    """
+    try:
+        result = subprocess.run(
+            [PDFTOTEXT_CMD, "-layout", "-l", str(page_count), file_path, "-"],
+            capture_output=True,
+            check=True,
+            timeout=30,
+        )
+    except (OSError, subprocess.SubprocessError) as e:
+        print("Text layer extraction unavailable:", e)
+        return [""] * page_count
+
+    pages = result.stdout.decode("utf-8", errors="ignore").split("\f")
+    pages += [""] * (page_count - len(pages))
+    return pages[:page_count]
+
+
+def has_usable_text_layer(page_text: str) -> bool:
+    stripped = "".join(page_text.split())
+    if len(stripped) < TEXT_LAYER_MIN_CHARS:
+        return False
+
+    alnum = sum(1 for ch in stripped if ch.isalnum())
+    return alnum / len(stripped) >= TEXT_LAYER_MIN_ALNUM_RATIO
+
+
+def _pool_map(fn: Callable, items: Iterable, on_result: Callable[[], None] | None = None) -> list:
+    """
+    Ordered map over the OCR process pool with back-pressure:
+    at most OCR_MAX_IN_FLIGHT items are held in memory at once.
+    on_result is called after each item finishes (progress reporting).
+    """
+    if OCR_WORKERS <= 1:
+        results = []
+        for item in items:
+            results.append(fn(item))
+            if on_result:
+                on_result()
+        return results
+
+    in_flight = deque()
+    results = []
+
+    def submit(item):
+        pool = _ocr_pool
+        try:
+            return _submit_ocr_job(fn, item)
+        except RuntimeError:
+            # BrokenProcessPool, or "cannot schedule new futures after shutdown"
+            # when the pool broke and was shut down by another thread
+            _recycle_ocr_pool(pool)
+            return _submit_ocr_job(fn, item)
+
+    def collect_oldest():
+        item, pool, future = in_flight.popleft()
+
+        for attempt in range(OCR_POOL_RESUBMITS + 1):
+            try:
+                results.append(future.result(timeout=OCR_PAGE_TIMEOUT_SECONDS))
+                break
+            except FutureTimeoutError:
+                print(f"OCR page not done after {OCR_PAGE_TIMEOUT_SECONDS}s, killing the pool")
+                _recycle_ocr_pool(pool, kill=True)
+                if attempt == OCR_POOL_RESUBMITS:
+                    raise
+            except (BrokenProcessPool, CancelledError):
+                # The pool broke (or was shut down) under this page: resubmit it
+                print("OCR pool broke mid-job, resubmitting page")
+                _recycle_ocr_pool(pool)
+                if attempt == OCR_POOL_RESUBMITS:
+                    results.append(fn(item))
+                    break
+            pool, future = submit(item)
+
+        if on_result:
+            on_result()
+
+    for item in items:
+        in_flight.append((item, *submit(item)))
+
+        # Wait for the oldest job before rendering more pages
+        if len(in_flight) >= OCR_MAX_IN_FLIGHT:
+            collect_oldest()
+
+    while in_flight:
+        collect_oldest()
+
+    return results
+
+
+def ocr_pages(pages: Iterable[Image.Image], on_page: Callable[[], None] | None = None) -> list[dict]:
+    """
+    OCR page images across the process pool.
+    Structured page results are returned in the same order as the input pages.
+    """
+    return _pool_map(_ocr_page, pages, on_result=on_page)
+
+
+def _ocr_preview_page(img: Image.Image) -> list[dict]:
+    # Low-DPI pass: Tesseract lines with their positions, in preview pixels
+    return _lines_from_data(_image_to_data(_preprocess(img)))
+
+
+def _key_regions(lines: list[dict]) -> list[tuple[int, int]]:
+    """
+    Vertical bands (preview pixels) around lines that mention a key field,
+    padded by a couple of line heights and merged when they overlap.
+    """
+    if not lines:
+        return []
+
+    heights = sorted(l["bbox"][3] - l["bbox"][1] for l in lines)
+    margin = heights[len(heights) // 2] * ROI_MARGIN_LINES
+
+    regions = []
+    for line in sorted(lines, key=lambda l: l["bbox"][1]):
+        if not KEY_FIELD_PATTERN.search(line["text"]):
+            continue
+        top = max(0, line["bbox"][1] - margin)
+        bottom = line["bbox"][3] + margin
+
+        if regions and top <= regions[-1][1]:
+            regions[-1] = (regions[-1][0], max(regions[-1][1], bottom))
+        else:
+            regions.append((top, bottom))
+
+    return regions
+
+
+def _ocr_page_regions(job: tuple[Image.Image, list[tuple[int, int]]]) -> list[list[dict]]:
+    # High-DPI pass over full-width horizontal bands of one page
+    img, regions = job
+    region_lines = []
+    for top, bottom in regions:
+        crop = img.crop((0, top, img.width, min(bottom, img.height)))
+        region_lines.append(_lines_from_data(_image_to_data(_preprocess(crop)), offset_top=top))
+    return region_lines
+
+
+def _scale_line(line: dict, scale: float) -> dict:
+    def scaled(bbox):
+        return [int(v * scale) for v in bbox]
+
+    # Marked so the low confidence retry ignores low-DPI lines
+    return {
+        **line,
+        "bbox": scaled(line["bbox"]),
+        "words": [{**w, "bbox": scaled(w["bbox"])} for w in line["words"]],
+        "preview": True,
+    }
+
+
+def _assemble_page(
+    lines: list[dict],
+    regions: list[tuple[int, int]],
+    region_lines: list[list[dict]],
+    scale: float,
+) -> list[dict]:
+    # Preview lines everywhere except inside key regions, which use the high-DPI lines
+    out = []
+    emitted = set()
+    for line in lines:
+        centre = (line["bbox"][1] + line["bbox"][3]) / 2
+        idx = next((i for i, (top, bottom) in enumerate(regions) if top <= centre <= bottom), None)
+
+        if idx is None:
+            out.append(_scale_line(line, scale))
+        elif idx not in emitted:
+            out.extend(region_lines[idx])
+            emitted.add(idx)
+
+    return out
+
+
+def ocr_pages_adaptive(
+    file_path: str,
+    page_numbers: list[int],
+    on_page: Callable[[], None] | None = None,
+) -> list[dict]:
+    """
+    Adaptive DPI OCR: preview every page at OCR_PREVIEW_DPI, then re-render
+    only pages with key fields at OCR_DPI and OCR just those regions.
+    Boilerplate and signature pages never pay for a 300 DPI pass.
+    """
+    previews = _pool_map(
+        _ocr_preview_page,
+        iter_pdf_pages(file_path, dpi=OCR_PREVIEW_DPI, page_numbers=page_numbers),
+        on_result=on_page,
+    )
+    regions = {n: _key_regions(lines) for n, lines in zip(page_numbers, previews)}
+
+    key_pages = [n for n in page_numbers if regions[n]]
+    print(f"Adaptive OCR: {len(key_pages)}/{len(page_numbers)} pages need high DPI")
+
+    scale = OCR_DPI / OCR_PREVIEW_DPI
+    jobs = (
+        (img, [(int(top * scale), int(bottom * scale)) for top, bottom in regions[n]])
+        for n, img in zip(key_pages, iter_pdf_pages(file_path, dpi=OCR_DPI, page_numbers=key_pages))
+    )
+    region_lines = dict(zip(key_pages, _pool_map(_ocr_page_regions, jobs)))
+
+    return [
+        _page_result(
+            _assemble_page(lines, regions[n], region_lines.get(n, []), scale),
+            "ocr_adaptive",
+        )
+        for n, lines in zip(page_numbers, previews)
+    ]
+
+
+def _retry_confidence(page: dict) -> float | None:
+    """
+    Mean confidence the retry decision is based on. Adaptive pages only
+    count their high-DPI key lines: preview lines are low confidence by
+    design and a 400 DPI retry would undo the adaptive savings.
+    """
+    lines = [l for l in page["lines"] if not l.get("preview")]
+    if not lines:
+        return None
+    return sum(l["confidence"] for l in lines) / len(lines)
+
+
+def _retry_low_confidence_pages(file_path: str, pages: dict[int, dict]) -> None:
+    """
+    Re-OCR only the pages whose mean confidence is poor, at a higher DPI,
+    keeping whichever result Tesseract is more confident about.
+    """
+    confidences = {n: _retry_confidence(page) for n, page in pages.items()}
+    low_pages = [
+        n for n in sorted(pages)
+        if confidences[n] is not None and confidences[n] < OCR_RETRY_BELOW_CONFIDENCE
+    ]
+    if not low_pages:
+        return
+
+    print(f"Re-OCR low confidence pages: {low_pages}")
+    retried = _pool_map(
+        _ocr_page_retry,
+        iter_pdf_pages(file_path, dpi=OCR_RETRY_DPI, page_numbers=low_pages),
+    )
+    for n, page in zip(low_pages, retried):
+        if page["confidence"] > confidences[n]:
+            page["dpi"] = OCR_RETRY_DPI
+            pages[n] = page
+
+
+def _text_layer_page(page_text: str) -> dict:
+    lines = [
+        {"text": line.strip(), "confidence": TEXT_LAYER_CONFIDENCE, "bbox": None, "words": []}
+        for line in page_text.splitlines()
+        if line.strip()
+    ]
+    return _page_result(lines, "text_layer", text=page_text)
+
+
+def document_text(document: dict, min_confidence: float | None = None) -> str:
+    """
+    Plain text of a structured OCR result. With min_confidence, only lines
+    Tesseract is at least that confident about are kept (e.g. for the LLM).
+    """
     text = ""
+    for page in document["pages"]:
+        if min_confidence is None:
+            text += page["text"] + "\n"
+        else:
+            kept = [l["text"] for l in page["lines"] if l["confidence"] >= min_confidence]
+            text += "\n".join(kept) + "\n"
+    return text
+
+
+def high_confidence_text(document: dict) -> str:
+    return document_text(document, min_confidence=OCR_LLM_MIN_LINE_CONFIDENCE)
+
+
+def file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def ocr_cache_key(file_hash: str) -> str:
+    """
+    Cache key = file content hash + every setting that changes OCR output.
+    """
+    settings = "|".join([
+        str(OCR_DPI),
+        TESSERACT_CONFIG,
+        OCR_PREPROCESSOR,
+        OCR_THRESHOLD_MODE,
+        str(PREPROCESS_VERSION),
+        str(OCR_RESULT_VERSION),
+        str(OCR_MAX_PAGES),
+        str(TEXT_LAYER_MIN_CHARS),
+        str(TEXT_LAYER_MIN_ALNUM_RATIO),
+        f"adaptive={OCR_PREVIEW_DPI}" if OCR_ADAPTIVE else "full",
+        f"retry={OCR_RETRY_BELOW_CONFIDENCE}@{OCR_RETRY_DPI}",
+    ])
+    return hashlib.sha256(f"{file_hash}|{settings}".encode("utf-8")).hexdigest()
+
+
+def extract_document(
+    file_path: str,
+    file_hash: str | None = None,
+    on_progress: Callable[[int, int], None] | None = None,
+) -> dict:
+    """
+    Structured OCR result of a PDF / image / txt upload:
+    {"pages": [{"page", "source", "confidence", "text", "lines": [...]}]}
+    where every line carries its words, bounding boxes and confidences.
+    PDFs longer than OCR_MAX_PAGES also get
+    "truncated": {"pages_total", "pages_processed"}.
+    OCR results are cached by file content, so re-uploads skip rendering.
+    on_progress(pages_done, pages_total) is called as pages complete.
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+
+    if ext in [".pdf", ".png", ".jpg", ".jpeg"]:
+        key = ocr_cache_key(file_hash or file_sha256(file_path))
+
+        cached = ocr_cache.get(key)
+        if cached is not None:
+            print("✅ Using cached OCR text")
+            document = cached["document"]
+            if on_progress:
+                on_progress(len(document["pages"]), len(document["pages"]))
+            return document
 
+        document = _extract_document_uncached(file_path, ext, on_progress)
+        ocr_cache.set(key, {"text": document_text(document), "document": document})
+        return document
+
+    elif ext == ".txt":
+        with open(file_path, "r", encoding="utf-8") as f:
+            page = _text_layer_page(f.read())
+        return {"pages": [{"page": 1, **page}]}
+
+    else:
+        raise ValueError("Unsupported file format")
+
+
+def extract_text(file_path: str, file_hash: str | None = None) -> str:
+    return document_text(extract_document(file_path, file_hash))
+
+
+def _extract_document_uncached(
+    file_path: str,
+    ext: str,
+    on_progress: Callable[[int, int], None] | None = None,
+) -> dict:
     if ext == ".pdf":
-        pages = convert_from_path(file_path, dpi=300)
-
-        for page in pages:
-            processed = preprocess_image(page)
-
-            page_text = pytesseract.image_to_string(
-                processed,
-                config=(
-                    "--oem 3 "
-                    "--psm 4 "   # better for columns/tables
-                    "-c preserve_interword_spaces=1 "
-                    "-c tessedit_char_whitelist="
-                    "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz.,:/()- "
+        total_pages = pdf_total_pages(file_path)
+        page_count = min(total_pages, OCR_MAX_PAGES)
+        if total_pages > page_count:
+            print(f"⚠️ PDF has {total_pages} pages, only the first {page_count} are processed (OCR_MAX_PAGES)")
+
+        layer_texts = extract_text_layer(file_path, page_count)
+
+        # Only pages without a usable text layer are rasterized and OCRed
+        pages = {
+            n: _text_layer_page(layer_texts[n - 1])
+            for n in range(1, page_count + 1)
+            if has_usable_text_layer(layer_texts[n - 1])
+        }
+        scanned_pages = [n for n in range(1, page_count + 1) if n not in pages]
+        print(f"Text layer pages: {len(pages)}/{page_count}")
+
+        pages_done = len(pages)
+
+        def page_finished():
+            nonlocal pages_done
+            pages_done += 1
+            if on_progress:
+                on_progress(pages_done, page_count)
+
+        if on_progress:
+            on_progress(pages_done, page_count)
+
+        if scanned_pages:
+            # Pages are streamed into the pool, never all held in memory
+            if OCR_ADAPTIVE:
+                ocr_results = ocr_pages_adaptive(file_path, scanned_pages, on_page=page_finished)
+            else:
+                ocr_results = ocr_pages(
+                    iter_pdf_pages(file_path, page_numbers=scanned_pages),
+                    on_page=page_finished,
                 )
-            )
-            text += page_text + "\n"
 
-        return text
+            for n, page in zip(scanned_pages, ocr_results):
+                page["dpi"] = OCR_DPI
+                pages[n] = page
+
+            _retry_low_confidence_pages(file_path, pages)
+
+        document = {"pages": [{"page": n, **pages[n]} for n in sorted(pages)]}
+        if total_pages > page_count:
+            document["truncated"] = {"pages_total": total_pages, "pages_processed": page_count}
+        return document
 
     elif ext in [".png", ".jpg", ".jpeg"]:
         img = Image.open(file_path)
-        processed = preprocess_image(img)
-
-        return pytesseract.image_to_string(
-            processed,
-            config=(
-                "--oem 3 "
-                "--psm 4 "
-                "-c preserve_interword_spaces=1 "
-                "-c tessedit_char_whitelist="
-                "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz.,:/()- "
-            )
-        )
-
-    elif ext == ".txt":
-        with open(file_path, "r", encoding="utf-8") as f:
-            return f.read()
+        page = _ocr_page(img)
+        if on_progress:
+            on_progress(1, 1)
+        return {"pages": [{"page": 1, **page}]}
 
     else:
         raise ValueError("Unsupported file format")
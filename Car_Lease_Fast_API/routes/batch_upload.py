@@ -0,0 +1,153 @@
+import os
+import zipfile
+from typing import List
+
+from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
+from sqlalchemy.orm import Session
+
+from auth import get_current_user
+from database import get_db
+from models import UploadJob
+from upload_pipeline import UPLOAD_DIR, batch_manifest_entry, create_batch_jobs, store_upload, submit_batch
+
+router = APIRouter()
+
+SUPPORTED_EXTENSIONS = {".pdf", ".png", ".jpg", ".jpeg", ".txt"}
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", "500"))
+
+# Checked against the zip directory before anything is extracted
+MAX_BATCH_BYTES = int(os.getenv("MAX_BATCH_BYTES", str(1024 * 1024 * 1024)))
+
+
+def _is_supported(filename: str) -> bool:
+    return os.path.splitext(filename)[1].lower() in SUPPORTED_EXTENSIONS
+
+
+def _supported_members(archive: zipfile.ZipFile) -> list[zipfile.ZipInfo]:
+    # basename only: never trust paths inside the archive
+    return [
+        member for member in archive.infolist()
+        if not member.is_dir() and _is_supported(os.path.basename(member.filename))
+    ]
+
+
+def batch_file_size(filename: str, fileobj) -> tuple[int, int]:
+    """
+    (supported files, bytes once stored) for one batch member without
+    storing anything; zip archives are measured from their directory.
+    """
+    if filename.lower().endswith(".zip"):
+        with zipfile.ZipFile(fileobj) as archive:
+            members = _supported_members(archive)
+            return len(members), sum(member.file_size for member in members)
+
+    if not _is_supported(filename):
+        return 0, 0
+
+    size = fileobj.seek(0, os.SEEK_END)
+    fileobj.seek(0)
+    return 1, size
+
+
+def store_batch_file(user_id: int, filename: str, fileobj) -> list[tuple[str, str, str]]:
+    """
+    Store one batch member. Zip archives are expanded (flat, supported
+    files only); returns [(filename, stored_filename, content_hash), ...].
+    """
+    if filename.lower().endswith(".zip"):
+        stored = []
+        with zipfile.ZipFile(fileobj) as archive:
+            for member in _supported_members(archive):
+                member_name = os.path.basename(member.filename)
+                with archive.open(member) as member_file:
+                    stored.append((member_name, *store_upload(user_id, member_name, member_file)))
+        return stored
+
+    if not _is_supported(filename):
+        return []
+
+    return [(filename, *store_upload(user_id, filename, fileobj))]
+
+
+def remove_stored_files(uploads: list[tuple[str, str, str]]) -> None:
+    for _, stored_filename, _ in uploads:
+        try:
+            os.remove(os.path.join(UPLOAD_DIR, stored_filename))
+        except OSError:
+            pass
+
+
+@router.post("/upload/batch")
+def upload_batch(
+    files: List[UploadFile] = File(...),
+    current_user=Depends(get_current_user),
+):
+    """
+    Fleet onboarding: many lease files and/or zip archives in one request.
+    Returns the batch id and the job id of every file right away; poll
+    GET /upload/batch/{batch_id} for the manifest or GET /upload/{job_id}.
+    """
+    # LIMITS (before anything is written to disk)
+    total_files = 0
+    total_bytes = 0
+    for file in files:
+        try:
+            count, size = batch_file_size(file.filename, file.file)
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail=f"Invalid zip archive: {file.filename}")
+        total_files += count
+        total_bytes += size
+
+    if not total_files:
+        raise HTTPException(status_code=400, detail="No supported lease files in batch")
+
+    if total_files > MAX_BATCH_FILES:
+        raise HTTPException(status_code=400, detail=f"Batch limit is {MAX_BATCH_FILES} files")
+
+    if total_bytes > MAX_BATCH_BYTES:
+        raise HTTPException(status_code=400, detail=f"Batch limit is {MAX_BATCH_BYTES // (1024 * 1024)} MB uncompressed")
+
+    # STORE
+    uploads = []
+    try:
+        for file in files:
+            uploads.extend(store_batch_file(current_user.id, file.filename, file.file))
+        batch_id, job_ids = create_batch_jobs(current_user.id, uploads)
+    except Exception:
+        # No orphaned files when a member fails half way
+        remove_stored_files(uploads)
+        raise
+
+    submit_batch(job_ids)
+
+    return {
+        "batch_id": batch_id,
+        "total": len(job_ids),
+        "files": [
+            {"filename": filename, "job_id": job_id, "status": "queued"}
+            for (filename, _, _), job_id in zip(uploads, job_ids)
+        ],
+    }
+
+
+@router.get("/upload/batch/{batch_id}")
+def get_batch(batch_id: str, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+    """Per-file manifest of a batch upload, complete once pending is 0."""
+    jobs = (
+        db.query(UploadJob)
+        .filter(UploadJob.batch_id == batch_id, UploadJob.user_id == current_user.id)
+        .order_by(UploadJob.created_at, UploadJob.filename)
+        .all()
+    )
+    if not jobs:
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    manifest = [batch_manifest_entry(job) for job in jobs]
+    return {
+        "batch_id": batch_id,
+        "total": len(manifest),
+        "completed": sum(1 for m in manifest if m["status"] == "completed"),
+        "failed": sum(1 for m in manifest if m["status"] == "failed"),
+        "pending": sum(1 for m in manifest if m["status"] in ("queued", "running")),
+        "files": manifest,
+    }
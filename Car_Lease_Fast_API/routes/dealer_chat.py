@@ -8,6 +8,7 @@ from dealer_auth import get_current_dealer
 from pydantic import BaseModel
 from auth import get_current_user
 from external_ai import call_customer_negotiation_ai
+from lease_digest import get_lease_digest
 
 
 router = APIRouter()
@@ -33,36 +34,6 @@ def ai_negotiation_suggestion(
     analysis = lease.analysis_result or {}
     fairness = lease.fairness_analysis or {}
 
-    monthly_payment = analysis.get("monthly_payment", "Unknown")
-    residual_value = analysis.get("residual_value", "Unknown")
-    money_factor = analysis.get("money_factor", "Unknown")
-    fairness_score = fairness.get("score", "Unknown")
-
-    prompt = f"""
-You are a professional car lease negotiation expert.
-
-Lease Information:
-VIN: {lease.vin}
-Monthly Payment: {monthly_payment}
-Residual Value: {residual_value}
-Money Factor: {money_factor}
-Fairness Score: {fairness_score}
-
-Dealer just said:
-"{request.dealer_message}"
-
-Give 3 short, strong, polite negotiation responses 
-the customer can say next.
-
-Focus on:
-- Lowering monthly payment
-- Reducing fees
-- Improving residual or money factor
-- Asking for breakdown if unclear
-
-Keep it concise and strategic.
-"""
-
     vehicle_data = lease.vehicle_api_data or {}
 
     make = vehicle_data.get("make")
@@ -75,6 +46,8 @@ Keep it concise and strategic.
         vin=lease.vin,
         make=make,
         model=model,
+        user_key=user.id,
+        digest=get_lease_digest(lease),
     )
 
 
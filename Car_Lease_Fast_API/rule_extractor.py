@@ -0,0 +1,305 @@
+import copy
+import re
+from datetime import datetime
+
+from vin_decoder import is_valid_vin
+
+# Same structure the extraction prompt asks the LLM for
+LEASE_SCHEMA = {
+    "parties": {"lessor": None, "lessee": None},
+    "lease_details": {
+        "lease_duration": None,
+        "start_date": None,
+        "end_date": None,
+        "rent_amount": None,
+        "payment_terms": None,
+    },
+    "vehicle_details": {
+        "maker": None,
+        "model": None,
+        "year": None,
+        "body_style": None,
+        "color": None,
+        "vehicle_id_number": None,
+        "registration_number": None,
+    },
+    "financials": {
+        "base_monthly_payment": None,
+        "monthly_tax": None,
+        "total_monthly_payment": None,
+        "total_of_payments": None,
+        "residual_value": None,
+        "purchase_option_price": None,
+    },
+    "penalties": {
+        "early_termination_charge": None,
+        "late_payment_fee": None,
+        "excess_wear_charges": None,
+    },
+    "termination_clause": None,
+}
+
+# Fields at or above this confidence are not sent to the LLM
+RULE_MIN_CONFIDENCE = 0.8
+
+# MATCH SCORING
+# Values that fail their rule's validator (or are placeholders) are dropped.
+# A valid value scores base + VALID_BONUS, plus ANCHOR_BONUS when its label
+# starts the line. Bases are 0.6, so a valid value mid-sentence (0.75) stays
+# below RULE_MIN_CONFIDENCE and only an anchored one (0.85) skips the LLM.
+# A field matched with different values is ambiguous and goes to the LLM.
+ANCHOR_BONUS = 0.1
+VALID_BONUS = 0.15
+CONFLICT_PENALTY = 0.2
+MAX_CONFIDENCE = 0.99
+
+_SEP = r" ?[:\-]? ?"
+# Free-text values (names, make, colour) need an explicit "Label:" to be trusted
+_LABEL = r" ?: ?"
+# Case-sensitive capital in otherwise case-insensitive patterns
+_CAPITAL = r"(?-i:[A-Z])"
+_CAPITAL_OR_DIGIT = r"(?-i:[A-Z0-9])"
+_AMOUNT = r"((?:INR|Rs\.?|₹)\s*\d[\d,]*(?:\.\d{1,2})?)"
+_AMOUNT_OR_PCT = r"((?:INR|Rs\.?|₹)\s*\d[\d,]*(?:\.\d{1,2})?|\d{1,2}(?:\.\d+)?\s*%)"
+_MONTHS = r"(?:jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec)[a-z]*\.?"
+_DATE = (
+    rf"(\d{{1,2}}(?:st|nd|rd|th)?\s+{_MONTHS},?\s+\d{{4}}"
+    rf"|{_MONTHS}\s+\d{{1,2}}(?:st|nd|rd|th)?,?\s+\d{{4}}"
+    r"|\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4})"
+)
+
+# Numbering or bullets allowed before a label that starts its line ("3.", "(a)", "-")
+_LINE_PREFIX = re.compile(r"(?:\(?[0-9a-z]{1,3}[.)]|[-•*])?\s*", re.IGNORECASE)
+
+# Values that point elsewhere instead of stating the field
+_PLACEHOLDER = re.compile(
+    r"(?:as\s+per|refer|see\s|annexure|schedule|attached|mentioned|to\s+be\b|tbd\b|n/?a\b|nil\b|not\s+applicable)",
+    re.IGNORECASE,
+)
+
+
+def _valid_text(value: str) -> bool:
+    return sum(c.isalpha() for c in value) >= 2
+
+
+def _valid_vin(value: str) -> bool:
+    return is_valid_vin(value.upper())
+
+
+def _valid_registration(value: str) -> bool:
+    compact = re.sub(r"[\s-]", "", value.upper())
+    return re.fullmatch(r"[A-Z]{2}\d{1,2}[A-Z]{0,3}\d{1,4}", compact) is not None
+
+
+def _valid_year(value: str) -> bool:
+    return 1980 <= int(value) <= datetime.utcnow().year + 1
+
+
+def _valid_date(value: str) -> bool:
+    numeric = re.fullmatch(r"(\d{1,2})[/.-](\d{1,2})[/.-](\d{2,4})", value)
+    if not numeric:
+        return True
+    day, month = int(numeric.group(1)), int(numeric.group(2))
+    # Day-first (Indian) or month-first
+    return (1 <= day <= 31 and 1 <= month <= 12) or (1 <= month <= 31 and 1 <= day <= 12)
+
+
+def _valid_duration(value: str) -> bool:
+    number = int(re.match(r"\d+", value).group())
+    limit = 10 if "year" in value.lower() else 120
+    return 1 <= number <= limit
+
+
+def _valid_amount(value: str) -> bool:
+    digits = re.sub(r"[^\d.]", "", value.replace("Rs.", ""))
+    try:
+        return float(digits) > 0
+    except ValueError:
+        return False
+
+
+def _valid_amount_or_pct(value: str) -> bool:
+    if value.endswith("%"):
+        return 0 < float(value.rstrip("% ")) <= 100
+    return _valid_amount(value)
+
+
+# (field path, pattern, base confidence, validator)
+FIELD_RULES = [
+    ("vehicle_details.vehicle_id_number",
+     r"(?:\bVIN\b|vehicle\s+identification\s+(?:number|no\.?)|chassis\s+(?:number|no\.?))" + _SEP + r"([A-HJ-NPR-Z0-9]{17})\b",
+     0.6, _valid_vin),
+    ("vehicle_details.registration_number",
+     r"registration\s+(?:number|no\.?)" + _SEP + r"([A-Z]{2}[\s-]?\d{1,2}[\s-]?[A-Z]{0,3}[\s-]?\d{1,4})\b",
+     0.6, _valid_registration),
+    # Only years of the vehicle: not "financial year 2025-26" or "year 2024"
+    ("vehicle_details.year",
+     r"(?:\bmodel\s+year|\byear\s+of\s+(?:manufacture|make)|\b(?:manufacturing|mfg\.?)\s+year|^year)"
+     + _SEP + r"((?:19|20)\d{2})\b(?!\s*[/\-]\s*\d)",
+     0.6, _valid_year),
+    ("vehicle_details.maker",
+     r"\b(?:make|maker|manufacturer)" + _LABEL + r"(" + _CAPITAL + r"[A-Za-z\-]+(?: " + _CAPITAL + r"[A-Za-z\-]+)?)",
+     0.6, _valid_text),
+    ("vehicle_details.model",
+     r"\bmodel(?!\s+year)" + _LABEL + r"(" + _CAPITAL_OR_DIGIT + r"[\w\-]*(?: " + _CAPITAL_OR_DIGIT + r"[\w\-]*){0,2})",
+     0.6, _valid_text),
+    ("vehicle_details.color",
+     r"\bcolou?r" + _LABEL + r"([A-Za-z]+(?: [A-Za-z]+)?)",
+     0.6, _valid_text),
+    ("vehicle_details.body_style",
+     r"body\s+(?:style|type)" + _LABEL + r"([A-Za-z]+(?: [A-Za-z]+)?)",
+     0.6, _valid_text),
+
+    ("parties.lessor",
+     r"\blessor" + _LABEL + r"(" + _CAPITAL + r"[^\n,;]{2,80})",
+     0.6, _valid_text),
+    ("parties.lessee",
+     r"\blessee" + _LABEL + r"(" + _CAPITAL + r"[^\n,;]{2,80})",
+     0.6, _valid_text),
+
+    ("lease_details.start_date",
+     r"(?:start|commencement)\s+date" + _SEP + _DATE,
+     0.6, _valid_date),
+    ("lease_details.end_date",
+     r"(?:end|expiry|expiration)\s+date" + _SEP + _DATE,
+     0.6, _valid_date),
+    # The lease's own term only: "Interest period 12 months" is not it
+    ("lease_details.lease_duration",
+     r"(?:\blease\s+(?:term|duration|period|tenure)|\b(?:term|duration|period|tenure)\s+of\s+(?:the\s+)?lease"
+     r"|^(?:term|duration|tenure))"
+     + _SEP + r"(\d{1,3}\s*(?:months?|years?))\b",
+     0.6, _valid_duration),
+    ("lease_details.rent_amount",
+     r"(?:monthly\s+)?rent(?:al)?(?:\s+amount)?" + _SEP + _AMOUNT,
+     0.6, _valid_amount),
+    ("lease_details.payment_terms",
+     r"payment\s+(?:terms|schedule)" + _LABEL + r"([^\n]{3,160})",
+     0.6, _valid_text),
+
+    ("termination_clause",
+     r"termination(?:\s+clause)?" + _LABEL + r"([^\n]{10,400})",
+     0.6, _valid_text),
+
+    ("financials.total_monthly_payment",
+     r"total\s+monthly\s+payment" + _SEP + _AMOUNT,
+     0.6, _valid_amount),
+    ("financials.base_monthly_payment",
+     r"(?<!total )(?:base\s+)?monthly\s+(?:lease\s+)?(?:payment|instal(?:l)?ment)" + _SEP + _AMOUNT,
+     0.6, _valid_amount),
+    ("financials.monthly_tax",
+     r"monthly\s+(?:tax|gst)" + _SEP + _AMOUNT,
+     0.6, _valid_amount),
+    ("financials.total_of_payments",
+     r"total\s+of\s+(?:all\s+)?payments" + _SEP + _AMOUNT,
+     0.6, _valid_amount),
+    ("financials.residual_value",
+     r"residual\s+value" + _SEP + _AMOUNT,
+     0.6, _valid_amount),
+    ("financials.purchase_option_price",
+     r"purchase\s+option(?:\s+(?:price|amount))?" + _SEP + _AMOUNT,
+     0.6, _valid_amount),
+
+    ("penalties.early_termination_charge",
+     r"early\s+termination\s+(?:fee|charge|penalty)(?:\s+of)?" + _SEP + _AMOUNT_OR_PCT,
+     0.6, _valid_amount_or_pct),
+    ("penalties.late_payment_fee",
+     r"late\s+(?:payment\s+)?(?:fee|charge|penalty)(?:\s+of)?" + _SEP + _AMOUNT_OR_PCT,
+     0.6, _valid_amount_or_pct),
+    ("penalties.excess_wear_charges",
+     r"excess\s+(?:wear|mileage)[^:\n]{0,40}?(?:charge|fee)s?(?:\s+of)?" + _SEP + _AMOUNT_OR_PCT,
+     0.6, _valid_amount_or_pct),
+]
+
+_COMPILED_RULES = [
+    (path, re.compile(pattern, re.IGNORECASE | re.MULTILINE), base, validator)
+    for path, pattern, base, validator in FIELD_RULES
+]
+
+
+def field_paths(schema: dict = LEASE_SCHEMA, prefix: str = "") -> list[str]:
+    paths = []
+    for key, value in schema.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            paths.extend(field_paths(value, f"{path}."))
+        else:
+            paths.append(path)
+    return paths
+
+
+def get_field(data: dict, path: str):
+    for key in path.split("."):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+
+def set_field(data: dict, path: str, value) -> None:
+    keys = path.split(".")
+    for key in keys[:-1]:
+        data = data.setdefault(key, {})
+    data[keys[-1]] = value
+
+
+def schema_for(paths: list[str]) -> dict:
+    # Subset of LEASE_SCHEMA containing only the given field paths
+    subset = {}
+    for path in paths:
+        set_field(subset, path, None)
+    return subset
+
+
+def _anchored(text: str, match: re.Match) -> bool:
+    # The label starts its line, apart from numbering or a bullet
+    line_start = text.rfind("\n", 0, match.start()) + 1
+    return _LINE_PREFIX.fullmatch(text[line_start:match.start()]) is not None
+
+
+def _placeholder(text: str, match: re.Match) -> bool:
+    # Checked on the rest of the line: "Model: As per Annexure" only captures "As"
+    line_end = text.find("\n", match.start(1))
+    return _PLACEHOLDER.match(text[match.start(1):line_end if line_end != -1 else None]) is not None
+
+
+def _value_key(value: str) -> str:
+    return re.sub(r"[\s,.\-]", "", value.lower())
+
+
+def extract_lease_fields(text: str) -> tuple[dict, dict]:
+    """
+    Fill the lease JSON structure from regular patterns in our templates
+    (VIN, dates, INR amounts, duration, parties, ...).
+    Returns (result, confidences) where confidences maps field path -> 0..1
+    for every field that was found. Every match is scored and the best one
+    wins; see ANCHOR_BONUS / VALID_BONUS / CONFLICT_PENALTY.
+    """
+    # Collapse OCR spacing so patterns don't depend on layout
+    normalized = "\n".join(" ".join(line.split()) for line in text.splitlines())
+
+    result = copy.deepcopy(LEASE_SCHEMA)
+    confidences = {}
+
+    for path, pattern, base, validator in _COMPILED_RULES:
+        candidates = []
+        for match in pattern.finditer(normalized):
+            value = match.group(1).strip()
+            if _placeholder(normalized, match) or not validator(value):
+                continue
+            score = base + VALID_BONUS
+            if _anchored(normalized, match):
+                score += ANCHOR_BONUS
+            candidates.append((score, value))
+
+        if not candidates:
+            continue
+
+        # Highest score wins, the earliest match on ties
+        score, value = max(candidates, key=lambda candidate: candidate[0])
+        if len({_value_key(v) for _, v in candidates}) > 1:
+            score -= CONFLICT_PENALTY
+
+        set_field(result, path, value)
+        confidences[path] = round(min(score, MAX_CONFIDENCE), 2)
+
+    return result, confidences
@@ -1,32 +1,31 @@
-import requests
 import random
 
+from services.vin_lookup_service import VinLookupService
+from vin_decoder import decode_offline, is_valid_vin, normalize_vin
+
 
 class CarFullHistoryService:
 
+    def __init__(self):
+        self.vin_lookup = VinLookupService()
+
     def fetch_vehicle_specs(self, vin: str):
         """
-        Calls US Govt NHTSA VIN Decoder API
+        NHTSA specs via the shared VIN lookup (cached across workers).
+        VINs that fail offline validation are decoded locally instead.
         """
-        url = f"https://vpic.nhtsa.dot.gov/api/vehicles/decodevinvaluesextended/{vin}?format=json"
-
-        response = requests.get(url, timeout=10)
-
-        if response.status_code != 200:
-            raise Exception("Failed to fetch data from NHTSA")
-
-        data = response.json()
-
-        if not data.get("Results"):
-            raise Exception("Invalid VIN or no data from NHTSA")
-
-        result = data["Results"][0]
-
-        return {
-            "make": result.get("Make", "Unknown"),
-            "model": result.get("Model", "Unknown"),
-            "year": result.get("ModelYear", "Unknown")
-        }
+        # Callers pass user input: lower case, spaces or hyphens
+        vin = normalize_vin(vin) or (vin or "").strip().upper()
+
+        if not is_valid_vin(vin):
+            offline = decode_offline(vin)
+            return {
+                "make": offline["make"] or "Unknown",
+                "model": "Unknown",
+                "year": offline["model_year"] or "Unknown"
+            }
+
+        return self.vin_lookup.specs(vin)
 
     def generate_mock_history(self):
         """
@@ -0,0 +1,216 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+import http_client
+
+from database import SessionLocal
+from models import VinDecodeCache
+
+NHTSA_BASE_URL = "https://vpic.nhtsa.dot.gov/api/vehicles"
+
+# A VIN always decodes to the same vehicle, the TTL only picks up NHTSA corrections
+VIN_CACHE_TTL_DAYS = int(os.getenv("VIN_CACHE_TTL_DAYS", "365"))
+
+# BATCH DECODING
+# NHTSA accepts up to 50 VINs per DecodeVINValuesBatch request
+VIN_BATCH_SIZE = int(os.getenv("VIN_BATCH_SIZE", "50"))
+VIN_BATCH_CONCURRENCY = int(os.getenv("VIN_BATCH_CONCURRENCY", "4"))
+
+
+class VinLookupService:
+    """
+    Single entry point for NHTSA VIN decodes. Results of
+    decodevinvaluesextended are kept in the vin_decode_cache table so each
+    VIN is fetched from upstream at most once across all workers.
+    """
+
+    def __init__(self, ttl_days: int = VIN_CACHE_TTL_DAYS):
+        self.ttl = timedelta(days=ttl_days)
+
+    def lookup(self, vin: str) -> dict:
+        """
+        Raw NHTSA result (flat dict) for a VIN, from the cache when fresh.
+        """
+        vin = vin.strip().upper()
+
+        cached = self._get_cached(vin)
+        if cached is not None:
+            print(f"✅ VIN decode cache hit: {vin}")
+            return cached
+
+        print(f"🌐 Decoding VIN via NHTSA: {vin}")
+        result = self._fetch(vin)
+        self._store(vin, result)
+        return result
+
+    def lookup_many(self, vins: list[str]) -> dict:
+        """
+        Raw NHTSA results for many VINs: one cache query, then the misses
+        in DecodeVINValuesBatch groups of VIN_BATCH_SIZE, VIN_BATCH_CONCURRENCY
+        at a time. VINs NHTSA returned nothing for are left out.
+        """
+        wanted = list(dict.fromkeys(vin.strip().upper() for vin in vins if vin))
+
+        results = self._get_cached_many(wanted)
+        missing = [vin for vin in wanted if vin not in results]
+        print(f"VIN BATCH: {len(results)} cached, {len(missing)} to fetch")
+
+        groups = [missing[i:i + VIN_BATCH_SIZE] for i in range(0, len(missing), VIN_BATCH_SIZE)]
+        fetched = {}
+
+        if groups:
+            with ThreadPoolExecutor(max_workers=VIN_BATCH_CONCURRENCY, thread_name_prefix="vin-batch") as pool:
+                for group_results in pool.map(self._fetch_batch_safe, groups):
+                    fetched.update(group_results)
+
+        self._store_many(fetched)
+        results.update(fetched)
+        return results
+
+    def decode(self, vin: str) -> dict:
+        """Vehicle summary stored as vehicle_api_data on uploads."""
+        return self._summarize(vin, self.lookup(vin))
+
+    def decode_many(self, vins: list[str]) -> dict:
+        return {vin: self._summarize(vin, result) for vin, result in self.lookup_many(vins).items()}
+
+    @staticmethod
+    def _summarize(vin: str, result: dict) -> dict:
+        def value(key):
+            # NHTSA reports missing values as empty strings
+            return result.get(key) or None
+
+        return {
+            "vin": vin,
+            "make": value("Make"),
+            "model": value("Model"),
+            "model_year": value("ModelYear"),
+            "body_class": value("BodyClass"),
+            "fuel_type": value("FuelTypePrimary"),
+            "engine_model": value("EngineModel"),
+            "plant_country": value("PlantCountry"),
+            "manufacturer": value("Manufacturer"),
+        }
+
+    def specs(self, vin: str) -> dict:
+        """Make / model / year used by the car history report."""
+        result = self.lookup(vin)
+
+        return {
+            "make": result.get("Make", "Unknown"),
+            "model": result.get("Model", "Unknown"),
+            "year": result.get("ModelYear", "Unknown")
+        }
+
+    def _fetch(self, vin: str) -> dict:
+        url = f"{NHTSA_BASE_URL}/decodevinvaluesextended/{vin}?format=json"
+
+        response = http_client.get(url)
+
+        if response.status_code != 200:
+            raise Exception("Failed to fetch data from NHTSA")
+
+        data = response.json()
+
+        if not data.get("Results"):
+            raise Exception("Invalid VIN or no data from NHTSA")
+
+        return data["Results"][0]
+
+    def _fetch_batch(self, vins: list[str]) -> dict:
+        url = f"{NHTSA_BASE_URL}/DecodeVINValuesBatch/"
+
+        # The batch decode is a read, safe to retry despite being a POST
+        response = http_client.post(
+            url,
+            data={"format": "json", "data": ";".join(vins)},
+            timeout=30,
+            retries=http_client.HTTP_RETRIES,
+        )
+
+        if response.status_code != 200:
+            raise Exception("Failed to fetch batch data from NHTSA")
+
+        results = {}
+        for item in response.json().get("Results", []):
+            vin = (item.get("VIN") or "").strip().upper()
+            if vin:
+                results[vin] = item
+        return results
+
+    def _fetch_batch_safe(self, vins: list[str]) -> dict:
+        # One failed group must not lose the rest of the batch
+        try:
+            return self._fetch_batch(vins)
+        except Exception as e:
+            print(f"❌ VIN batch of {len(vins)} failed:", e)
+            return {}
+
+    def _get_cached_many(self, vins: list[str]) -> dict:
+        if not vins:
+            return {}
+
+        now = datetime.utcnow()
+        results = {}
+        db = SessionLocal()
+        try:
+            # Keep IN lists a reasonable size for large backfills
+            for i in range(0, len(vins), 500):
+                rows = db.query(VinDecodeCache).filter(VinDecodeCache.vin.in_(vins[i:i + 500])).all()
+                results.update({row.vin: row.results for row in rows if row.expires_at > now})
+            return results
+        finally:
+            db.close()
+
+    def _store_many(self, results: dict) -> None:
+        if not results:
+            return
+
+        now = datetime.utcnow()
+        db = SessionLocal()
+        try:
+            for vin, result in results.items():
+                db.merge(VinDecodeCache(
+                    vin=vin,
+                    results=result,
+                    fetched_at=now,
+                    expires_at=now + self.ttl,
+                ))
+            db.commit()
+        except IntegrityError:
+            # Another worker stored some of these first, fall back to one by one
+            db.rollback()
+            for vin, result in results.items():
+                self._store(vin, result)
+        finally:
+            db.close()
+
+    def _get_cached(self, vin: str) -> dict | None:
+        db = SessionLocal()
+        try:
+            row = db.query(VinDecodeCache).filter(VinDecodeCache.vin == vin).first()
+            if row and row.expires_at > datetime.utcnow():
+                return row.results
+            return None
+        finally:
+            db.close()
+
+    def _store(self, vin: str, result: dict) -> None:
+        now = datetime.utcnow()
+        db = SessionLocal()
+        try:
+            db.merge(VinDecodeCache(
+                vin=vin,
+                results=result,
+                fetched_at=now,
+                expires_at=now + self.ttl,
+            ))
+            db.commit()
+        except IntegrityError:
+            # Another worker stored the same VIN first
+            db.rollback()
+        finally:
+            db.close()
@@ -0,0 +1,21 @@
+from rule_extractor import RULE_MIN_CONFIDENCE, extract_lease_fields
+
+
+def test_mid_sentence_matches_stay_below_threshold():
+    text = (
+        "The lessee shall pay the outstanding total monthly payment INR 1,000 plus interest.\n"
+        "The residual value - INR 2,00,000 may be revised at the end of the term.\n"
+    )
+    _, confidences = extract_lease_fields(text)
+
+    assert confidences["financials.total_monthly_payment"] < RULE_MIN_CONFIDENCE
+    assert confidences["financials.residual_value"] < RULE_MIN_CONFIDENCE
+
+
+def test_anchored_matches_reach_threshold():
+    text = "Total Monthly Payment: INR 1,000\nResidual Value: INR 2,00,000\n"
+    result, confidences = extract_lease_fields(text)
+
+    assert result["financials"]["residual_value"] == "INR 2,00,000"
+    assert confidences["financials.total_monthly_payment"] >= RULE_MIN_CONFIDENCE
+    assert confidences["financials.residual_value"] >= RULE_MIN_CONFIDENCE
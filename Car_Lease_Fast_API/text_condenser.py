@@ -0,0 +1,98 @@
+import re
+from collections import Counter
+
+# Rough token estimate for Llama-style tokenizers on English text
+CHARS_PER_TOKEN = 4
+
+# Documents below this size are only cleaned, never trimmed to sections
+CONDENSE_MIN_TOKENS = 1500
+
+# A short line seen this many times (page counters ignored) is a page header/footer
+REPEATED_LINE_MIN_COUNT = 3
+REPEATED_LINE_MAX_CHARS = 80
+
+# Lines kept around every line that mentions a schema field
+CONTEXT_LINES = 2
+
+# Whole words (stems take any suffix), so "current", "amend" or "remark"
+# do not count as lease fields
+FIELD_PATTERN = re.compile(
+    r"\b(?:lessor|lessee|landlord|tenant|customer|dealer|between|party|parties|"
+    r"dated?|commenc\w*|start\w*|ends?|ended|ending|expir\w*|terms?|duration|months?|years?|"
+    r"jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|june?|july?|aug(?:ust)?|"
+    r"sep(?:t|tember)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?|"
+    r"rents?|rental|payments?|monthly|instal\w*|tax\w*|gst|total|residual|purchase|options?|"
+    r"deposits?|fees?|charges?|amounts?|price|inr|rs|"
+    r"penalt\w*|late|wear|mileage|excess\w*|terminat\w*|cancel\w*|default\w*|"
+    r"vehicles?|vin|chassis|make|maker|model|colou?r|body|registration)\b"
+    # "may" is only a month next to a day or year
+    r"|\b\d{1,2}\s*may\b|\bmay\s*\d{1,4}\b"
+    r"|₹|\d{1,3}(?:,\d{2,3})+",
+    re.IGNORECASE,
+)
+
+PAGE_NUMBER_PATTERN = re.compile(r"^(page\s*)?\d+(\s*(of|/)\s*\d+)?$", re.IGNORECASE)
+
+# Page counters inside a header/footer line ("Page 3 of 12", "3 of 12")
+PAGE_TOKEN_PATTERN = re.compile(r"\bpage\s*\d+(\s*(of|/)\s*\d+)?\b|\b\d+\s+of\s+\d+\b", re.IGNORECASE)
+
+# Lines with an amount are never treated as headers (payment schedule rows)
+AMOUNT_PATTERN = re.compile(r"₹|\brs\b|\binr\b|\d{1,3}(,\d{2,3})+|\d+\.\d{2}\b", re.IGNORECASE)
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _line_key(line: str) -> str:
+    # Only page counters are masked: rows that differ in dates or amounts stay distinct
+    return PAGE_TOKEN_PATTERN.sub("#", line.lower())
+
+
+def _is_header_candidate(line: str) -> bool:
+    return len(line) <= REPEATED_LINE_MAX_CHARS and not AMOUNT_PATTERN.search(line)
+
+
+def condense_lease_text(text: str) -> tuple[str, dict]:
+    """
+    Shrink OCR text before it goes into the extraction prompt:
+    collapse whitespace, drop page numbers and repeated headers/footers,
+    and for long documents keep only lines near lease fields
+    (parties, dates, financials, penalties, termination, vehicle).
+    Returns (condensed_text, token stats).
+    """
+    lines = [" ".join(line.split()) for line in text.splitlines()]
+    lines = [line for line in lines if line and not PAGE_NUMBER_PATTERN.match(line)]
+
+    # Repeated headers/footers: keep the first occurrence only
+    counts = Counter(_line_key(line) for line in lines if _is_header_candidate(line))
+    seen = set()
+    deduped = []
+    for line in lines:
+        key = _line_key(line)
+        if _is_header_candidate(line) and counts[key] >= REPEATED_LINE_MIN_COUNT:
+            if key in seen:
+                continue
+            seen.add(key)
+        deduped.append(line)
+    lines = deduped
+
+    condensed = "\n".join(lines)
+
+    if estimate_tokens(condensed) > CONDENSE_MIN_TOKENS:
+        keep = set()
+        for i, line in enumerate(lines):
+            if FIELD_PATTERN.search(line):
+                keep.update(range(max(0, i - CONTEXT_LINES), min(len(lines), i + CONTEXT_LINES + 1)))
+        condensed = "\n".join(line for i, line in enumerate(lines) if i in keep)
+
+    original_tokens = estimate_tokens(text)
+    condensed_tokens = estimate_tokens(condensed)
+    saved = original_tokens - condensed_tokens
+
+    return condensed, {
+        "original_tokens": original_tokens,
+        "condensed_tokens": condensed_tokens,
+        "saved_tokens": saved,
+        "saved_pct": round(100 * saved / original_tokens, 1) if original_tokens else 0.0,
+    }
@@ -0,0 +1,773 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import BinaryIO
+
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import LeaseAnalysis, UploadJob
+from ocr_utils import extract_document, document_text, high_confidence_text
+from llm_utils import analyze_lease
+from lease_digest import refresh_lease_digest
+from fairness_utils import calculate_fairness
+from vin_utils import decode_vin, extract_vin_from_text
+from vin_decoder import is_valid_vin, normalize_vin
+from services.car_full_history_service import CarFullHistoryService
+from price_estimator import estimate_car_price
+
+UPLOAD_DIR = "uploads"
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Bounded executor: at most UPLOAD_WORKERS leases are analyzed at once per API worker
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "4"))
+_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="upload")
+
+# Car history fetches wait on slow external APIs, keep them off the upload workers
+HISTORY_WORKERS = int(os.getenv("HISTORY_WORKERS", "4"))
+_history_executor = ThreadPoolExecutor(max_workers=HISTORY_WORKERS, thread_name_prefix="car-history")
+
+# JOB RECOVERY
+# Every process touches the jobs it owns every UPLOAD_JOB_HEARTBEAT_SECONDS, so
+# queued / running jobs not updated for UPLOAD_JOB_STALE_SECONDS were lost with
+# their process (restart, crash). The API looks for them every UPLOAD_JOB_RECOVERY_SECONDS.
+UPLOAD_JOB_HEARTBEAT_SECONDS = int(os.getenv("UPLOAD_JOB_HEARTBEAT_SECONDS", "30"))
+UPLOAD_JOB_STALE_SECONDS = int(os.getenv("UPLOAD_JOB_STALE_SECONDS", "180"))
+UPLOAD_JOB_RECOVERY_SECONDS = int(os.getenv("UPLOAD_JOB_RECOVERY_SECONDS", "60"))
+
+# Jobs queued or running in this process
+_active_jobs: set[str] = set()
+_active_jobs_lock = threading.Lock()
+_heartbeat_thread = None
+
+# Global limits shared by single and batch uploads: documents in OCR at once
+# (bounds rendered page memory) and concurrent LLM extraction calls
+OCR_DOCUMENT_SLOTS = threading.BoundedSemaphore(int(os.getenv("OCR_DOCUMENT_SLOTS", "4")))
+LLM_SLOTS = threading.BoundedSemaphore(int(os.getenv("LLM_SLOTS", "4")))
+
+# Batch ingestion: files analyzed concurrently per batch
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "8"))
+# Batches running at once per API worker; the upload request returns before they finish
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "1"))
+_batch_executor = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix="batch-run")
+
+# Reuse another user's analysis of byte-identical uploads (opt-in: copies their extracted data)
+DEDUPE_ACROSS_USERS = os.getenv("DEDUPE_ACROSS_USERS", "0") == "1"
+
+# Car history fetches in flight in this process: vin -> record ids waiting on it
+_history_flights: dict[str, set[int]] = {}
+_history_lock = threading.Lock()
+
+# store -> ocr -> llm_extract -> vin_decode -> scoring -> persist
+STAGE_PROGRESS = {
+    "store": 5,
+    "ocr": 15,
+    "llm_extract": 45,
+    "vin_decode": 70,
+    "scoring": 80,
+    "persist": 90,
+    "done": 100,
+}
+
+
+def store_upload(user_id: int, filename: str, fileobj: BinaryIO) -> tuple[str, str]:
+    """
+    Save an upload under a unique name, hashing it while it streams in
+    (the hash drives dedup and the OCR cache).
+    Returns (stored_filename, content_hash).
+    """
+    timestamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+    stored_filename = f"{user_id}_{timestamp}_{uuid.uuid4().hex[:8]}_{filename}"
+    file_path = os.path.join(UPLOAD_DIR, stored_filename)
+
+    digest = hashlib.sha256()
+    with open(file_path, "wb") as buffer:
+        for chunk in iter(lambda: fileobj.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+            buffer.write(chunk)
+
+    return stored_filename, digest.hexdigest()
+
+
+def submit_upload_job(job_id: str) -> None:
+    _track_jobs([job_id])
+    _executor.submit(run_upload_job, job_id)
+
+
+def _track_jobs(job_ids: list[str]) -> None:
+    global _heartbeat_thread
+    with _active_jobs_lock:
+        _active_jobs.update(job_ids)
+        if _heartbeat_thread is None:
+            _heartbeat_thread = threading.Thread(target=_heartbeat_loop, name="upload-heartbeat", daemon=True)
+            _heartbeat_thread.start()
+
+
+def _untrack_jobs(job_ids: list[str]) -> None:
+    with _active_jobs_lock:
+        _active_jobs.difference_update(job_ids)
+
+
+def _heartbeat_loop() -> None:
+    # Keeps this process's jobs fresh so no worker mistakes them for lost ones
+    while True:
+        time.sleep(UPLOAD_JOB_HEARTBEAT_SECONDS)
+        with _active_jobs_lock:
+            job_ids = list(_active_jobs)
+        if not job_ids:
+            continue
+
+        db = SessionLocal()
+        try:
+            db.query(UploadJob).filter(
+                UploadJob.id.in_(job_ids),
+                UploadJob.status.in_(("queued", "running"))
+            ).update({"updated_at": datetime.utcnow()}, synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            print("❌ Upload job heartbeat failed:", e)
+        finally:
+            db.close()
+
+
+def recover_stale_jobs() -> None:
+    """
+    Requeue jobs left queued or running by a dead process when their file
+    is still stored, otherwise mark them failed. Each job is claimed with a
+    conditional UPDATE, so only one API worker picks it up.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=UPLOAD_JOB_STALE_SECONDS)
+    db = SessionLocal()
+
+    try:
+        stale = db.query(UploadJob.id, UploadJob.status, UploadJob.updated_at, UploadJob.stored_filename).filter(
+            UploadJob.status.in_(("queued", "running")),
+            UploadJob.updated_at < cutoff
+        ).all()
+
+        requeued = []
+        failed = 0
+        for job_id, status, updated_at, stored_filename in stale:
+            if os.path.exists(os.path.join(UPLOAD_DIR, stored_filename)):
+                changes = {"status": "queued", "stage": "store", "progress": STAGE_PROGRESS["store"]}
+            else:
+                changes = {"status": "failed", "error": "Upload was interrupted by a server restart"}
+
+            # Same status and updated_at as read: nobody claimed or touched it since
+            claimed = db.query(UploadJob).filter(
+                UploadJob.id == job_id,
+                UploadJob.status == status,
+                UploadJob.updated_at == updated_at
+            ).update({**changes, "updated_at": datetime.utcnow()}, synchronize_session=False)
+            db.commit()
+
+            if not claimed:
+                continue
+            if changes["status"] == "queued":
+                requeued.append(job_id)
+            else:
+                failed += 1
+
+        for job_id in requeued:
+            submit_upload_job(job_id)
+
+        if requeued or failed:
+            print(f"♻️ Recovered stale upload jobs: {len(requeued)} requeued, {failed} failed")
+
+    finally:
+        db.close()
+
+
+def _recovery_loop() -> None:
+    while True:
+        try:
+            recover_stale_jobs()
+        except Exception as e:
+            print("❌ Upload job recovery failed:", e)
+        time.sleep(UPLOAD_JOB_RECOVERY_SECONDS)
+
+
+def start_job_recovery() -> None:
+    """API startup: recover stale jobs now and every UPLOAD_JOB_RECOVERY_SECONDS."""
+    threading.Thread(target=_recovery_loop, name="upload-recovery", daemon=True).start()
+
+
+def _set_stage(db: Session, job: UploadJob, stage: str) -> None:
+    job.status = "running"
+    job.stage = stage
+    job.progress = STAGE_PROGRESS[stage]
+    db.commit()
+    print(f"[upload {job.id}] stage: {stage}")
+
+
+def _publish_partial(db: Session, job: UploadJob, **fields) -> None:
+    # Reassign (not mutate) so SQLAlchemy notices the JSON change
+    job.partial_result = {**(job.partial_result or {}), **fields}
+    db.commit()
+
+
+def _complete_job(job: UploadJob, result: dict) -> None:
+    job.status = "completed"
+    job.stage = "done"
+    job.progress = STAGE_PROGRESS["done"]
+    job.record_id = result["record_id"]
+
+    # Tell the user when pages past OCR_MAX_PAGES were not analyzed
+    truncated = (job.partial_result or {}).get("ocr_truncated")
+    job.result = {**result, "ocr_truncated": truncated} if truncated else result
+
+
+def _fail_job(db: Session, job: UploadJob, error: Exception) -> None:
+    db.rollback()
+    if isinstance(error, HTTPException):
+        job.error = str(error.detail)
+    else:
+        print(f"[upload {job.id}] failed:", error)
+        job.error = "Lease analysis failed"
+    job.status = "failed"
+    db.commit()
+
+
+def run_upload_job(job_id: str) -> None:
+    _track_jobs([job_id])
+    db = SessionLocal()
+
+    try:
+        job = db.query(UploadJob).filter(UploadJob.id == job_id).first()
+        if job is None:
+            print(f"[upload {job_id}] job not found")
+            return
+
+        try:
+            analysis = _analyze(db, job)
+
+            if isinstance(analysis, LeaseAnalysis):
+                db.add(analysis)
+                db.commit()
+                print("===== RECORD SAVED ID =====", analysis.id)
+                db.refresh(analysis)
+                _after_persist(analysis)
+                result = completed_record_response(analysis)
+            else:
+                result = analysis
+
+            _complete_job(job, result)
+            db.commit()
+
+        except Exception as e:
+            _fail_job(db, job, e)
+
+    finally:
+        db.close()
+        _untrack_jobs([job_id])
+
+
+def completed_record_response(record: LeaseAnalysis) -> dict:
+    return {
+        "message": "Lease analysis completed and stored",
+        "record_id": record.id,
+        "filename": record.filename,
+        "vin": record.vin,
+        "analysis_result": record.analysis_result,
+        "fairness_analysis": record.fairness_analysis,
+        "vehicle_api_data": record.vehicle_api_data,
+        "car_full_history": record.car_full_history,
+        "price_estimation": record.price_estimation,
+    }
+
+
+def existing_record_response(record: LeaseAnalysis) -> dict:
+    return {
+        "message": "Existing analysis found",
+        "record_id": record.id,
+        "filename": record.filename,
+        "vin": record.vin,
+        "analysis_result": record.analysis_result,
+        "fairness_analysis": record.fairness_analysis,
+        "price_estimation": record.price_estimation,
+        "vehicle_api_data": record.vehicle_api_data,
+        "car_full_history": record.car_full_history
+    }
+
+
+def parse_analysis(raw_output: str) -> dict:
+    if not raw_output:
+        raise HTTPException(status_code=500, detail="Groq returned empty response")
+
+    # CLEAN & PARSE JSON
+    cleaned = re.sub(r"```json|```", "", raw_output).strip()
+
+    try:
+        parsed_json = json.loads(cleaned)
+
+        # Build summary from important fields
+        lease_details = parsed_json.get("lease_details", {})
+        financials = parsed_json.get("financials", {})
+        penalties = parsed_json.get("penalties", {})
+
+        summary_parts = []
+
+        if lease_details.get("start_date"):
+            summary_parts.append(f"Lease starts on {lease_details.get('start_date')}")
+
+        if lease_details.get("end_date"):
+            summary_parts.append(f"and ends on {lease_details.get('end_date')}")
+
+        if lease_details.get("lease_duration"):
+            summary_parts.append(f"for a duration of {lease_details.get('lease_duration')}")
+
+        summary = " ".join(summary_parts) if summary_parts else None
+
+        monthly_payment = financials.get("total_monthly_payment") or financials.get("base_monthly_payment")
+
+        # Build potential issues list from penalties
+        issues = []
+        for k, v in penalties.items():
+            if v:
+                issues.append(f"{k.replace('_', ' ').title()}: {v}")
+
+        # Simple negotiation tips (rule-based for now)
+        negotiation_tips = []
+
+        if monthly_payment:
+            negotiation_tips.append("Ask if the monthly payment can be reduced or fixed.")
+
+        if financials.get("residual_value"):
+            negotiation_tips.append("Negotiate the residual value at the end of lease.")
+
+        if penalties.get("early_termination_charge"):
+            negotiation_tips.append("Try to reduce early termination charges.")
+
+        print("MAPPED SUMMARY:", summary)
+        print("MAPPED MONTHLY PAYMENT:", monthly_payment)
+        print("MAPPED ISSUES:", issues)
+        print("MAPPED NEGOTIATION TIPS:", negotiation_tips)
+
+    except Exception as e:
+        print("JSON PARSE ERROR:", e)
+        print("RAW GROQ:", raw_output)
+        raise HTTPException(status_code=500, detail="Groq returned invalid JSON")
+
+    return parsed_json
+
+
+def _find_duplicate(db: Session, job: UploadJob) -> dict | None:
+    """
+    Reuse a stored analysis of the exact same file before any OCR/LLM work.
+    The user's own record wins; otherwise another user's analysis is copied
+    into a new record for this user (when DEDUPE_ACROSS_USERS is on).
+    """
+    own_record = (
+        db.query(LeaseAnalysis)
+        .filter(
+            LeaseAnalysis.content_hash == job.content_hash,
+            LeaseAnalysis.user_id == job.user_id
+        )
+        .first()
+    )
+
+    if own_record:
+        return existing_record_response(own_record)
+
+    if not DEDUPE_ACROSS_USERS:
+        return None
+
+    shared_record = (
+        db.query(LeaseAnalysis)
+        .filter(LeaseAnalysis.content_hash == job.content_hash)
+        .first()
+    )
+
+    if not shared_record:
+        return None
+
+    print("✅ Reusing analysis of identical upload", shared_record.id)
+    record = LeaseAnalysis(
+        user_id=job.user_id,
+        filename=job.filename,
+        stored_filename=job.stored_filename,
+        content_hash=job.content_hash,
+        analysis_result=shared_record.analysis_result,
+        fairness_analysis=shared_record.fairness_analysis,
+        price_estimation=shared_record.price_estimation,
+        vin=shared_record.vin,
+        vehicle_api_data=shared_record.vehicle_api_data,
+        car_full_history=shared_record.car_full_history,
+    )
+    refresh_lease_digest(record)
+    db.add(record)
+    db.commit()
+    db.refresh(record)
+
+    return completed_record_response(record)
+
+
+def _analyze(db: Session, job: UploadJob) -> LeaseAnalysis | dict:
+    """
+    Run the analysis stages for one upload job.
+    Returns an unsaved LeaseAnalysis (the caller persists it, singly or in
+    bulk) or, for duplicates, the response of the already stored analysis.
+    """
+    file_path = os.path.join(UPLOAD_DIR, job.stored_filename)
+
+    # DEDUP BY CONTENT HASH (before any OCR / LLM work)
+    duplicate = _find_duplicate(db, job)
+    if duplicate:
+        return duplicate
+
+    # OCR
+    _set_stage(db, job, "ocr")
+
+    def ocr_progress(pages_done: int, pages_total: int) -> None:
+        job.pages_done = pages_done
+        job.pages_total = pages_total
+        db.commit()
+
+    with OCR_DOCUMENT_SLOTS:
+        ocr_document = extract_document(file_path, file_hash=job.content_hash, on_progress=ocr_progress)
+    extracted_text = document_text(ocr_document)
+
+    if ocr_document.get("truncated"):
+        truncated = ocr_document["truncated"]
+        print(f"[upload {job.id}] only {truncated['pages_processed']} of {truncated['pages_total']} pages analyzed")
+        _publish_partial(db, job, ocr_truncated=truncated)
+
+    print("EXTRACTED TEXT LENGTH:", len(extracted_text) if extracted_text else "NO TEXT")
+
+    if not extracted_text or len(extracted_text.strip()) == 0:
+        raise HTTPException(status_code=400, detail="No text extracted from PDF")
+
+    # LLM EXTRACTION
+    _set_stage(db, job, "llm_extract")
+    print("====== OCR EXTRACTED TEXT (FIRST 2000 CHARS) ======")
+    print(extracted_text[:2000])
+    print("====== END OCR TEXT ======")
+
+    # Low-confidence OCR lines are mostly noise, keep them out of the prompt
+    with LLM_SLOTS:
+        raw_output = analyze_lease(high_confidence_text(ocr_document), user_key=job.user_id)
+
+    print("====== GROQ RAW OUTPUT ======")
+    print(raw_output)
+    print("====== END GROQ OUTPUT ======")
+
+    parsed_json = parse_analysis(raw_output)
+    _publish_partial(db, job, analysis_result=parsed_json)
+
+    # VIN DECODE
+    _set_stage(db, job, "vin_decode")
+    vehicle_section = parsed_json.get("vehicle_details", {})
+    vin = normalize_vin(vehicle_section.get("vehicle_id_number"))
+
+    # Fallback: best validated VIN candidate in the OCR text
+    if not is_valid_vin(vin):
+        vin = extract_vin_from_text(extracted_text) or vin
+
+    vehicle_api_data = None
+    if vin:
+        try:
+            vehicle_api_data = decode_vin(vin)
+        except Exception as e:
+            vehicle_api_data = {"error": str(e)}
+
+    _publish_partial(db, job, vin=vin, vehicle_api_data=vehicle_api_data)
+
+    # SCORING
+    _set_stage(db, job, "scoring")
+    fairness_result = calculate_fairness(parsed_json)
+
+    price_estimation = estimate_car_price(
+        vehicle_details=parsed_json.get("vehicle_details", {}),
+        car_history=None,
+        fairness_analysis=fairness_result,
+    )
+    _publish_partial(db, job, fairness_analysis=fairness_result, price_estimation=price_estimation)
+
+    # SMART CAR HISTORY FETCH (DB CACHE FIRST)
+    car_full_history = None
+
+    if vin:
+        history_record = db.query(LeaseAnalysis).filter(
+            LeaseAnalysis.vin == vin,
+            LeaseAnalysis.car_full_history.isnot(None)
+        ).first()
+
+        if history_record:
+            print("✅ Using cached car history from DB")
+            car_full_history = history_record.car_full_history
+        else:
+            print("🌐 Fetching car history from API")
+
+    # PERSIST (caller adds the record)
+    _set_stage(db, job, "persist")
+    record = LeaseAnalysis(
+        user_id=job.user_id,
+        filename=job.filename,
+        stored_filename=job.stored_filename,
+        content_hash=job.content_hash,
+        analysis_result=parsed_json,
+        fairness_analysis=fairness_result,
+        price_estimation=price_estimation,
+        vin=vin,
+        vehicle_api_data=vehicle_api_data,
+        car_full_history=car_full_history,
+    )
+    refresh_lease_digest(record)
+    return record
+
+
+def _after_persist(record: LeaseAnalysis) -> None:
+    # RUN BACKGROUND CAR HISTORY FETCH
+    if record.vin and record.car_full_history is None:
+        _history_executor.submit(fetch_and_store_car_history, record.id, record.vin)
+
+
+def _analyze_batch_item(job_id: str) -> LeaseAnalysis | dict | None:
+    # Own session per thread; failures are recorded on the job and return None
+    db = SessionLocal()
+
+    try:
+        job = db.query(UploadJob).filter(UploadJob.id == job_id).first()
+        try:
+            # Unsaved records are not attached to this session, the batch session persists them
+            return _analyze(db, job)
+        except Exception as e:
+            _fail_job(db, job, e)
+            return None
+
+    finally:
+        db.close()
+
+
+def create_batch_jobs(user_id: int, uploads: list[tuple[str, str, str]]) -> tuple[str, list[str]]:
+    """
+    Queue one UploadJob per stored batch file under a new batch id.
+    Returns (batch_id, job ids in upload order).
+
+    uploads = [(filename, stored_filename, content_hash), ...]
+    """
+    batch_id = str(uuid.uuid4())
+    db = SessionLocal()
+
+    try:
+        jobs = [
+            UploadJob(
+                id=str(uuid.uuid4()),
+                user_id=user_id,
+                batch_id=batch_id,
+                filename=filename,
+                stored_filename=stored_filename,
+                content_hash=content_hash,
+                status="queued",
+                stage="store",
+                progress=STAGE_PROGRESS["store"],
+            )
+            for filename, stored_filename, content_hash in uploads
+        ]
+        db.add_all(jobs)
+        db.commit()
+        return batch_id, [job.id for job in jobs]
+
+    finally:
+        db.close()
+
+
+def submit_batch(job_ids: list[str]) -> None:
+    _batch_executor.submit(_run_batch, job_ids)
+
+
+def _run_batch(job_ids: list[str]) -> None:
+    try:
+        manifest = ingest_batch(job_ids)
+        completed = sum(1 for m in manifest if m["status"] == "completed")
+        print(f"===== BATCH DONE: {completed}/{len(manifest)} completed =====")
+    except Exception as e:
+        print("❌ Batch ingestion failed:", e)
+
+        # Nobody is waiting on the request any more, the jobs must not stay queued
+        db = SessionLocal()
+        try:
+            db.query(UploadJob).filter(
+                UploadJob.id.in_(job_ids),
+                UploadJob.status.in_(("queued", "running"))
+            ).update({"status": "failed", "error": "Lease analysis failed"}, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+
+def batch_manifest_entry(job: UploadJob) -> dict:
+    result = job.result or {}
+    return {
+        "filename": job.filename,
+        "job_id": job.id,
+        "status": job.status,
+        "record_id": job.record_id,
+        "vin": result.get("vin"),
+        "fairness_score": (result.get("fairness_analysis") or {}).get("fairness_score"),
+        "error": job.error,
+    }
+
+
+def ingest_batch(job_ids: list[str]) -> list[dict]:
+    """
+    Analyze the queued jobs of a batch and return a per-file manifest
+    (also available later from the jobs, see batch_manifest_entry).
+
+    Each distinct file content is analyzed once, BATCH_WORKERS at a time
+    (OCR/LLM concurrency is still capped globally), and all new
+    LeaseAnalysis rows are written in one bulk commit. Identical files
+    in the batch point at the one stored analysis, like any other
+    duplicate upload, and share its error when it fails.
+    """
+    _track_jobs(job_ids)
+    db = SessionLocal()
+
+    try:
+        jobs_by_id = {job.id: job for job in db.query(UploadJob).filter(UploadJob.id.in_(job_ids)).all()}
+        jobs = [jobs_by_id[job_id] for job_id in job_ids if job_id in jobs_by_id]
+
+        # Identical files inside the batch are analyzed only once
+        leaders = {}
+        for job in jobs:
+            leaders.setdefault(job.content_hash, job.id)
+
+        with ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="batch") as pool:
+            outcomes = dict(zip(leaders, pool.map(_analyze_batch_item, leaders.values())))
+
+        # BULK PERSIST (one new record per distinct file)
+        new_records = [outcome for outcome in outcomes.values() if isinstance(outcome, LeaseAnalysis)]
+        db.add_all(new_records)
+        db.commit()
+        print(f"===== BATCH SAVED {len(new_records)} RECORDS =====")
+
+        for record in new_records:
+            _after_persist(record)
+
+        for job in jobs:
+            db.refresh(job)
+
+        manifest = []
+        for job in jobs:
+            outcome = outcomes[job.content_hash]
+            leader = jobs_by_id[leaders[job.content_hash]]
+
+            if isinstance(outcome, LeaseAnalysis):
+                if job is leader:
+                    _complete_job(job, completed_record_response(outcome))
+                else:
+                    _complete_job(job, existing_record_response(outcome))
+            elif isinstance(outcome, dict):
+                _complete_job(job, outcome)
+            elif job is not leader:
+                job.status = "failed"
+                job.error = leader.error or "Lease analysis failed"
+            elif job.status != "failed":
+                job.status = "failed"
+                job.error = "Lease analysis failed"
+
+            manifest.append(batch_manifest_entry(job))
+
+        db.commit()
+        return manifest
+
+    finally:
+        db.close()
+        _untrack_jobs(job_ids)
+
+
+def fetch_and_store_car_history(record_id: int, vin: str):
+    """
+    Background car history fetch, single-flight per VIN: while a fetch for
+    the VIN is running, other records join it instead of fetching again,
+    and every waiting record is written from the one result.
+    """
+    with _history_lock:
+        flight = _history_flights.get(vin)
+        if flight is not None:
+            flight.add(record_id)
+            print(f"⏳ Joined in-flight car history fetch for VIN: {vin}")
+            return
+        _history_flights[vin] = {record_id}
+
+    car_history = None
+
+    try:
+        car_history = _load_car_history(vin)
+    except Exception as e:
+        print("❌ Background history fetch failed:", str(e))
+
+    # Drain waiters until nobody is left; records that join while we write
+    # are picked up by the next round
+    while True:
+        with _history_lock:
+            record_ids = _history_flights[vin]
+            if not record_ids or car_history is None:
+                del _history_flights[vin]
+                break
+            _history_flights[vin] = set()
+
+        try:
+            _store_car_history(record_ids, car_history)
+        except Exception as e:
+            print("❌ Background history save failed:", str(e))
+
+
+def _load_car_history(vin: str) -> dict:
+    db = SessionLocal()
+
+    try:
+        # Another worker process may have stored it already
+        history_record = db.query(LeaseAnalysis).filter(
+            LeaseAnalysis.vin == vin,
+            LeaseAnalysis.car_full_history.isnot(None)
+        ).first()
+
+        if history_record:
+            print("✅ Using cached car history from DB")
+            return history_record.car_full_history
+
+    finally:
+        db.close()
+
+    print(f"🌐 Background fetching car history for VIN: {vin}")
+
+    history_service = CarFullHistoryService()
+    return history_service.fetch_full_history(vin)
+
+
+def _store_car_history(record_ids: set[int], car_history: dict) -> None:
+    db = SessionLocal()
+
+    try:
+        records = db.query(LeaseAnalysis).filter(
+            LeaseAnalysis.id.in_(record_ids)
+        ).all()
+
+        # Digests differ per record, so build them here and write all rows at once
+        mappings = []
+        for record in records:
+            record.car_full_history = car_history
+            refresh_lease_digest(record)
+            mappings.append({
+                "id": record.id,
+                "car_full_history": car_history,
+                "context_digest": record.context_digest,
+                "context_digest_tokens": record.context_digest_tokens,
+            })
+
+        db.expunge_all()
+        db.bulk_update_mappings(LeaseAnalysis, mappings)
+        db.commit()
+
+        print(f"✅ Background car history saved for {len(mappings)} record(s)")
+
+    finally:
+        db.close()
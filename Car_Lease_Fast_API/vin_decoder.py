@@ -0,0 +1,268 @@
+"""
+Offline VIN validation and decoding (ISO 3779 / 49 CFR 565).
+
+Used before any NHTSA call: OCR candidates are scored and checked here,
+and the manufacturer, country and model year come from bundled tables.
+"""
+import re
+from datetime import datetime
+
+VIN_LENGTH = 17
+VIN_CHARS = "ABCDEFGHJKLMNPRSTUVWXYZ0123456789"
+
+# Check digit (position 9)
+TRANSLITERATION = {
+    **{str(d): d for d in range(10)},
+    "A": 1, "B": 2, "C": 3, "D": 4, "E": 5, "F": 6, "G": 7, "H": 8,
+    "J": 1, "K": 2, "L": 3, "M": 4, "N": 5, "P": 7, "R": 9,
+    "S": 2, "T": 3, "U": 4, "V": 5, "W": 6, "X": 7, "Y": 8, "Z": 9,
+}
+WEIGHTS = [8, 7, 6, 5, 4, 3, 2, 10, 0, 9, 8, 7, 6, 5, 4, 3, 2]
+
+# The check digit is only mandatory for North American and Chinese VINs;
+# elsewhere (including India) position 9 is often a manufacturer code
+CHECK_DIGIT_REQUIRED_PREFIXES = ("1", "2", "3", "4", "5", "L")
+
+# Model year (position 10), 30-year cycle starting 1980
+MODEL_YEAR_CODES = "ABCDEFGHJKLMNPRSTVWXY123456789"
+
+# WORLD MANUFACTURER IDENTIFIERS (first 3 characters)
+WMI_TABLE = {
+    # India
+    "MA1": "Mahindra & Mahindra",
+    "MA3": "Maruti Suzuki",
+    "MA6": "General Motors India",
+    "MAJ": "Ford India",
+    "MAK": "Honda Cars India",
+    "MAL": "Hyundai Motor India",
+    "MAT": "Tata Motors",
+    "MBJ": "Toyota Kirloskar Motor",
+    "MBR": "Mercedes-Benz India",
+    "MDH": "Nissan Motor India",
+    "MEE": "Renault India",
+    "MEX": "Skoda Auto Volkswagen India",
+    # North America
+    "1FA": "Ford",
+    "1FM": "Ford",
+    "1FT": "Ford",
+    "1G1": "Chevrolet",
+    "1GC": "Chevrolet",
+    "1C4": "Chrysler",
+    "1HG": "Honda",
+    "1N4": "Nissan",
+    "2HG": "Honda",
+    "2T1": "Toyota",
+    "3FA": "Ford",
+    "3VW": "Volkswagen",
+    "4T1": "Toyota",
+    "5UX": "BMW",
+    "5YJ": "Tesla",
+    # Asia
+    "JHM": "Honda",
+    "JN1": "Nissan",
+    "JTD": "Toyota",
+    "JTE": "Toyota",
+    "KMH": "Hyundai",
+    "KNA": "Kia",
+    "LFV": "FAW-Volkswagen",
+    "LSV": "SAIC Volkswagen",
+    # Europe
+    "SAJ": "Jaguar",
+    "SAL": "Land Rover",
+    "TMB": "Skoda",
+    "VF1": "Renault",
+    "VF3": "Peugeot",
+    "WAU": "Audi",
+    "WBA": "BMW",
+    "WDB": "Mercedes-Benz",
+    "WDD": "Mercedes-Benz",
+    "WVW": "Volkswagen",
+    "YV1": "Volvo",
+    "ZFA": "Fiat",
+}
+
+# Country of manufacture by first character, refined by second character ranges
+REGION_COUNTRIES = {
+    "1": "United States", "4": "United States", "5": "United States",
+    "2": "Canada", "3": "Mexico",
+    "J": "Japan", "K": "South Korea", "L": "China",
+    "S": "United Kingdom", "W": "Germany", "Z": "Italy",
+    "9": "Brazil",
+}
+COUNTRY_RANGES = [
+    ("M", "A", "E", "India"),
+    ("T", "J", "P", "Czech Republic"),
+    ("V", "F", "R", "France"),
+    ("V", "S", "W", "Spain"),
+    ("Y", "S", "W", "Sweden"),
+]
+
+VIN_KEYWORD_PATTERN = re.compile(
+    r"\bVIN\b|vehicle\s+identification|chassis\s+(?:number|no)",
+    re.IGNORECASE,
+)
+
+# OCR confusions for letters that never appear in a VIN
+OCR_CORRECTIONS = str.maketrans({"O": "0", "Q": "0", "I": "1"})
+
+# Characters scanned after a keyword for a VIN split by spaces or hyphens
+KEYWORD_WINDOW_CHARS = 60
+
+
+def check_digit(vin: str) -> str:
+    total = sum(TRANSLITERATION[char] * weight for char, weight in zip(vin, WEIGHTS))
+    remainder = total % 11
+    return "X" if remainder == 10 else str(remainder)
+
+
+def has_valid_structure(vin: str) -> bool:
+    return len(vin) == VIN_LENGTH and all(char in VIN_CHARS for char in vin)
+
+
+def check_digit_valid(vin: str) -> bool:
+    return has_valid_structure(vin) and vin[8] == check_digit(vin)
+
+
+def manufacturer(vin: str) -> str | None:
+    return WMI_TABLE.get(vin[:3])
+
+
+def country(vin: str) -> str | None:
+    first, second = vin[0], vin[1]
+    for region, start, end, name in COUNTRY_RANGES:
+        if first == region and start <= second <= end:
+            return name
+    return REGION_COUNTRIES.get(first)
+
+
+def model_year(vin: str, current_year: int | None = None) -> int | None:
+    code = vin[9]
+    if code not in MODEL_YEAR_CODES:
+        return None
+
+    base = 1980 + MODEL_YEAR_CODES.index(code)
+    current_year = current_year or datetime.utcnow().year
+
+    # North American VINs: position 7 picks the cycle (letter = 2010+, digit = 1980-2009)
+    if vin[0] in "12345":
+        return base + 30 if vin[6].isalpha() else base
+
+    # Otherwise the latest cycle that is not in the future
+    year = base
+    while year + 30 <= current_year + 1:
+        year += 30
+    return year
+
+
+def is_valid_vin(vin: str | None) -> bool:
+    """
+    True when the VIN is safe to send to NHTSA: correct structure, and a
+    matching check digit where the region requires one (elsewhere a known
+    manufacturer code is required instead).
+    """
+    if not vin or not has_valid_structure(vin):
+        return False
+
+    if check_digit_valid(vin):
+        return True
+
+    if vin.startswith(CHECK_DIGIT_REQUIRED_PREFIXES):
+        return False
+
+    return manufacturer(vin) is not None
+
+
+def normalize_vin(value: str | None) -> str | None:
+    if not value:
+        return None
+    vin = re.sub(r"[\s\-]", "", str(value)).upper().translate(OCR_CORRECTIONS)
+    return vin if has_valid_structure(vin) else None
+
+
+def decode_offline(vin: str) -> dict:
+    """
+    Decode what the VIN itself encodes. Same keys as vin_utils.decode_vin,
+    fields that need NHTSA are None.
+    """
+    valid = has_valid_structure(vin or "")
+    make = manufacturer(vin) if valid else None
+    year = model_year(vin) if valid else None
+
+    return {
+        "vin": vin,
+        "make": make,
+        "model": None,
+        "model_year": str(year) if year else None,
+        "body_class": None,
+        "fuel_type": None,
+        "engine_model": None,
+        "plant_country": country(vin) if valid else None,
+        "manufacturer": make,
+        "plant_code": vin[10] if valid else None,
+        "check_digit_valid": check_digit_valid(vin),
+        "source": "offline",
+    }
+
+
+def _score(vin: str, raw: str, labeled: bool) -> int:
+    score = 0
+    if check_digit_valid(vin):
+        score += 50
+    if manufacturer(vin):
+        score += 25
+    if labeled:
+        score += 30
+    if vin[9] in MODEL_YEAR_CODES:
+        score += 5
+    # Every OCR correction or split makes the candidate less certain
+    corrections = sum(1 for a, b in zip(raw.upper(), vin) if a != b)
+    score -= 5 * corrections
+    if not (any(c.isdigit() for c in vin) and any(c.isalpha() for c in vin)):
+        score -= 50
+    return score
+
+
+def find_vin_candidates(text: str) -> list[dict]:
+    """
+    All 17-character VIN candidates in OCR text, best first. Candidates
+    next to a VIN / chassis number label may be split by spaces or hyphens;
+    elsewhere only whole tokens are considered.
+    """
+    candidates = {}
+
+    def add(raw: str, labeled: bool):
+        vin = normalize_vin(raw)
+        if not vin:
+            return
+        raw = re.sub(r"[\s\-]", "", raw)
+        score = _score(vin, raw, labeled)
+        if vin not in candidates or candidates[vin]["score"] < score:
+            candidates[vin] = {
+                "vin": vin,
+                "score": score,
+                "labeled": labeled,
+                "check_digit_valid": check_digit_valid(vin),
+                "manufacturer": manufacturer(vin),
+            }
+
+    # Labeled: join the characters after the keyword
+    for match in VIN_KEYWORD_PATTERN.finditer(text):
+        window = text[match.end():match.end() + KEYWORD_WINDOW_CHARS]
+        window = re.sub(r"^[\s:.\-#]*(?:no\.?|number)?[\s:.\-#]*", "", window, flags=re.IGNORECASE)
+        chars = re.sub(r"[\s\-]", "", window)
+        if len(chars) >= VIN_LENGTH:
+            add(chars[:VIN_LENGTH], labeled=True)
+
+    # Unlabeled: whole alphanumeric tokens
+    for token in re.findall(r"\b[A-Za-z0-9]{17}\b", text):
+        add(token, labeled=False)
+
+    return sorted(candidates.values(), key=lambda c: c["score"], reverse=True)
+
+
+def best_vin(text: str) -> str | None:
+    """Highest scoring candidate that passes is_valid_vin, or None."""
+    for candidate in find_vin_candidates(text):
+        if is_valid_vin(candidate["vin"]):
+            return candidate["vin"]
+    return None
@@ -1,28 +1,63 @@
-import requests
+from vin_decoder import best_vin, decode_offline, is_valid_vin, normalize_vin
+from services.vin_lookup_service import VinLookupService
 
 def decode_vin(vin: str) -> dict:
     print("decode_vin() CALLED WITH:", vin)
 
-    url = f"https://vpic.nhtsa.dot.gov/api/vehicles/DecodeVin/{vin}?format=json"
-    response = requests.get(url, timeout=10)
+    offline = decode_offline(vin)
 
-    data = response.json()
+    # Only VINs that pass the check digit / WMI checks are worth an NHTSA call
+    if not is_valid_vin(vin):
+        print("⚠️ VIN failed validation, using offline decode only")
+        return offline
 
-    result = {}
-    for item in data.get("Results", []):
-        if item.get("Variable") and item.get("Value"):
-            result[item["Variable"]] = item["Value"]
+    try:
+        decoded = VinLookupService().decode(vin)
+    except Exception as e:
+        print("❌ NHTSA decode failed, using offline decode:", e)
+        return {**offline, "error": str(e)}
 
-    decoded = {
-        "vin": vin,
-        "make": result.get("Make"),
-        "model": result.get("Model"),
-        "model_year": result.get("Model Year"),
-        "body_class": result.get("Body Class"),
-        "fuel_type": result.get("Fuel Type - Primary"),
-        "engine_model": result.get("Engine Model"),
-        "plant_country": result.get("Plant Country"),
-        "manufacturer": result.get("Manufacturer Name"),
-    }
+    # Offline values fill whatever NHTSA left empty
+    merged = {**offline, **{key: value for key, value in decoded.items() if value}}
+    merged["source"] = "nhtsa"
+    return merged
 
+
+def decode_vins(vins: list[str]) -> dict:
+    """
+    Batch version of decode_vin, returns {vin: decoded}. Valid VINs are
+    decoded through NHTSA's batch endpoint, the rest offline. Valid VINs
+    NHTSA gave nothing for carry an "error" like decode_vin, so the
+    backfill can retry them.
+    """
+    # NHTSA results are keyed by the cleaned-up VIN
+    keys = {vin: normalize_vin(vin) or vin for vin in dict.fromkeys(vins)}
+    valid = list(dict.fromkeys(key for key in keys.values() if is_valid_vin(key)))
+
+    error = "No NHTSA result"
+    try:
+        online = VinLookupService().decode_many(valid)
+    except Exception as e:
+        print("❌ NHTSA batch decode failed, using offline decode:", e)
+        online = {}
+        error = str(e)
+
+    decoded = {}
+    for vin, key in keys.items():
+        offline = decode_offline(key)
+        if key in online:
+            decoded[vin] = {**offline, **{name: value for name, value in online[key].items() if value}}
+            decoded[vin]["source"] = "nhtsa"
+        elif is_valid_vin(key):
+            decoded[vin] = {**offline, "error": error}
+        else:
+            decoded[vin] = offline
     return decoded
+
+
+def extract_vin_from_text(text: str):
+    """
+    Best validated VIN in the OCR text. Candidates are scored on check
+    digit, known manufacturer code and proximity to a VIN label.
+    """
+    return best_vin(text)
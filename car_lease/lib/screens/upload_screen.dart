@@ -7,6 +7,7 @@ import 'package:http/http.dart' as http;
 import 'package:http_parser/http_parser.dart';
 import 'package:shared_preferences/shared_preferences.dart';
 
+import '../services/upload_service.dart';
 import 'result_screen.dart';
 import 'processing_screen.dart';
 
@@ -83,25 +84,29 @@ class _UploadScreenState extends State<UploadScreen> {
       final streamedResponse = await request.send();
       final responseBody = await streamedResponse.stream.bytesToString();
 
+      if (streamedResponse.statusCode != 200) {
+        Navigator.pop(context);
+        return;
+      }
+
+      final jobId = json.decode(responseBody)["job_id"];
+      // Upload returns a job id right away; poll until the analysis finishes
+      final result = await UploadService().waitForJob(jobId, token);
+
       Navigator.pop(context);
       _showProcessing(3);
       await Future.delayed(const Duration(milliseconds: 300));
 
-      if (streamedResponse.statusCode == 200) {
-        final decoded = json.decode(responseBody);
-        Navigator.pop(context);
+      Navigator.pop(context);
 
-        Navigator.push(
-          context,
-          MaterialPageRoute(
-            builder: (_) => ResultScreen(
-              result: Map<String, dynamic>.from(decoded ?? {}),
-            ),
+      Navigator.push(
+        context,
+        MaterialPageRoute(
+          builder: (_) => ResultScreen(
+            result: result,
           ),
-        );
-      } else {
-        Navigator.pop(context);
-      }
+        ),
+      );
     } catch (_) {
       Navigator.pop(context);
     }
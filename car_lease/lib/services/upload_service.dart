@@ -40,8 +40,8 @@ class UploadService {
       if (response.statusCode == 200) {
         final decoded = jsonDecode(body);
 
-        if (decoded is Map<String, dynamic>) {
-          return decoded;
+        if (decoded is Map<String, dynamic> && decoded["job_id"] != null) {
+          return await waitForJob(decoded["job_id"], token);
         } else {
           throw Exception("Invalid upload response format");
         }
@@ -56,4 +56,36 @@ class UploadService {
       throw Exception("Upload error: $e");
     }
   }
+
+  static const Duration pollInterval = Duration(seconds: 2);
+  static const Duration pollTimeout = Duration(minutes: 5);
+
+  /// Polls the upload job until the analysis is completed or failed,
+  /// giving up after [pollTimeout].
+  Future<Map<String, dynamic>> waitForJob(String jobId, String token) async {
+    final deadline = DateTime.now().add(pollTimeout);
+
+    while (DateTime.now().isBefore(deadline)) {
+      await Future.delayed(pollInterval);
+
+      final response = await http.get(
+        Uri.parse("$baseUrl/upload/$jobId"),
+        headers: {"Authorization": "Bearer $token"},
+      );
+
+      if (response.statusCode != 200) {
+        throw Exception("Upload status failed (${response.statusCode})");
+      }
+
+      final job = jsonDecode(response.body);
+      if (job["status"] == "completed") {
+        return Map<String, dynamic>.from(job["result"]);
+      }
+      if (job["status"] == "failed") {
+        throw Exception(job["error"] ?? "Lease analysis failed");
+      }
+    }
+
+    throw Exception("Lease analysis timed out");
+  }
 }